@@ -0,0 +1,204 @@
+"""
+Module that turns the state of an ElectricField into the field reports,
+warnings, lightning reports, and all clear notices sent out by
+spinningCan.py.
+
+The same AlertEngine is used for live data, replays of recordings, and the
+batch analysis of recordings so that they all follow the same rules.
+"""
+
+import numpy
+from collections import namedtuple
+
+from feed import HIGH_FIELD, VERY_HIGH_FIELD, FIELD_CLEARED, LIGHTNING_CLEARED
+
+__version__ = "0.1"
+__all__ = ['AlertEvent', 'AlertEngine',]
+
+
+# An event from the AlertEngine.  `type` is the feed message type ('FIELD',
+# 'DELTA', 'WARNING', 'NOTICE', or 'LIGHTNING'), `time` is a UNIX epoch, and
+# `values` is a tuple of the message values, i.e., the arguments needed by
+# feed.dataPublisher.publish().
+AlertEvent = namedtuple('AlertEvent', ['type', 'time', 'values'])
+
+
+def _minutes(value):
+    """
+    Convert a configuration interval in minutes to whole seconds.
+    """
+    
+    return int(60*float(value))
+
+
+class AlertEngine(object):
+    """
+    Class to decide when to send out field reports, high/very high field
+    warnings, lightning reports, and the all clear notices for them.  This
+    class:
+    
+      1) Sends the mean field and field change once per averaging window,
+      2) Sends field warnings at most once every `fieldInterval` seconds,
+      3) Sends lightning reports, for lightning seen during a high field, at
+         most once every `lightningInterval` seconds, and
+      4) Sends the all clear `fieldClearedInterval` or
+         `lightningClearedInterval` seconds after the last warning or
+         report.
+    
+    The engine only knows about time through the time stamps that it is given
+    so it behaves the same way for live data and for recordings.  `clock` can
+    be set to a function that returns a UNIX epoch to use in place of the
+    sample time stamps.
+    """
+    
+    def __init__(self, fieldInterval=60, fieldClearedInterval=60, lightningInterval=1,
+                 lightningClearedInterval=120, clock=None):
+        self.fieldInterval = fieldInterval
+        self.fieldClearedInterval = fieldClearedInterval
+        self.lightningInterval = lightningInterval
+        self.lightningClearedInterval = lightningClearedInterval
+        self.clock = clock
+        
+        self.reset()
+        
+    def reset(self):
+        """
+        Forget about any previous warnings and reports.
+        """
+        
+        self.count = 0
+        self.fieldHigh = False
+        self.lightningDetected = False
+        self.lastFieldEvent = None
+        self.lastLightningEvent = None
+        
+    def updateConfig(self, config):
+        """
+        Update the current configuration using a dictionary of values.
+        Values looked for are the 'report_interval' and 'cleared_interval'
+        entries, in minutes, of the 'efield' and 'lightning' sections.
+        """
+        
+        self.fieldInterval = _minutes(config['efield']['report_interval'])
+        self.fieldClearedInterval = _minutes(config['efield']['cleared_interval'])
+        self.lightningInterval = _minutes(config['lightning']['report_interval'])
+        self.lightningClearedInterval = _minutes(config['lightning']['cleared_interval'])
+        
+    def step(self, t, high, veryHigh, lightning, distance):
+        """
+        Advance the warning and report state by one sample at UNIX epoch `t`
+        with the given high field, very high field, and lightning flags and
+        lightning distance.  Returns a list of AlertEvents.
+        """
+        
+        events = []
+        
+        # Field warnings
+        if veryHigh or high:
+            if self.lastFieldEvent is None or t >= self.lastFieldEvent + self.fieldInterval:
+                events.append(AlertEvent('WARNING', t, (VERY_HIGH_FIELD if veryHigh else HIGH_FIELD,)))
+                self.lastFieldEvent = t
+            self.fieldHigh = True
+        elif self.fieldHigh and t >= self.lastFieldEvent + self.fieldClearedInterval:
+            events.append(AlertEvent('NOTICE', t, (FIELD_CLEARED,)))
+            self.fieldHigh = False
+            
+        # Lightning reports
+        if lightning and high:
+            if self.lastLightningEvent is None or t >= self.lastLightningEvent + self.lightningInterval:
+                events.append(AlertEvent('LIGHTNING', t, (distance,)))
+                self.lastLightningEvent = t
+            self.lightningDetected = True
+        elif self.lightningDetected and t >= self.lastLightningEvent + self.lightningClearedInterval:
+            events.append(AlertEvent('NOTICE', t, (LIGHTNING_CLEARED,)))
+            self.lightningDetected = False
+            
+        return events
+        
+    def update(self, efield, t=None):
+        """
+        Check an ElectricField that has just had a new value appended to it
+        and return a list of AlertEvents.  The time used is, in order of
+        preference, `t` (a UNIX epoch), the engine's clock, or the time stamp
+        of the newest value in `efield`.
+        """
+        
+        if t is None:
+            t = self.clock() if self.clock is not None else efield.lastTime()
+            
+        events = []
+        
+        # Field and field change reports
+        self.count += 1
+        if self.count % efield.nKeep == 0:
+            events.append(AlertEvent('FIELD', t, (efield.mean(),)))
+            events.append(AlertEvent('DELTA', t, (efield.deriv(),)))
+            self.count = 0
+            
+        high = efield.isHigh()
+        lightning = efield.isLightning() and high
+        distance = efield.getLightningDistance() if lightning else float('nan')
+        events.extend(self.step(t, high, efield.isVeryHigh(), lightning, distance))
+        
+        return events
+        
+    def run(self, efield, times, fields):
+        """
+        Run an entire sequence of time stamp/electric field value pairs
+        through the engine at once and return a list of AlertEvents.  This
+        gives the same events as appending the values one at a time to an
+        empty ElectricField with the same configuration as `efield` and
+        calling update() after each one.  Any earlier warnings and reports are
+        forgotten first, like the empty ElectricField, and `efield` itself is
+        not changed.
+        
+        The detection is done with ElectricField.detect() and, when the time
+        stamps are in order, only the samples where the field is high or
+        where an all clear could be due are stepped through.
+        """
+        
+        self.reset()
+        
+        result = efield.detect(times, fields)
+        times = result.times
+        n = times.size
+        events = []
+        
+        # Field and field change reports
+        for i in range(efield.nKeep - 1, n, efield.nKeep):
+            events.append((i, 0, AlertEvent('FIELD', float(times[i]), (float(result.mean[i]),))))
+            events.append((i, 0, AlertEvent('DELTA', float(times[i]), (float(result.deriv[i]),))))
+        self.count = n % efield.nKeep
+        
+        # Samples that have something going on
+        active = result.high | result.veryHigh
+        if numpy.all(numpy.diff(times) >= 0):
+            active = numpy.where(active)[0]
+        else:
+            active = numpy.arange(n)
+            
+        i = 0
+        for j in list(active) + [n,]:
+            # Nothing is high between i and j so the only thing that can happen
+            # is an all clear
+            if self.fieldHigh:
+                k = max(i, numpy.searchsorted(times, self.lastFieldEvent + self.fieldClearedInterval))
+                if k < j:
+                    events.append((k, 1, AlertEvent('NOTICE', float(times[k]), (FIELD_CLEARED,))))
+                    self.fieldHigh = False
+            if self.lightningDetected:
+                k = max(i, numpy.searchsorted(times, self.lastLightningEvent + self.lightningClearedInterval))
+                if k < j:
+                    events.append((k, 1, AlertEvent('NOTICE', float(times[k]), (LIGHTNING_CLEARED,))))
+                    self.lightningDetected = False
+                    
+            if j < n:
+                high = bool(result.high[j])
+                lightning = bool(result.lightning[j]) and high
+                for event in self.step(float(times[j]), high, bool(result.veryHigh[j]), lightning,
+                                       float(result.distance[j])):
+                    events.append((j, 1, event))
+            i = j + 1
+            
+        events.sort(key=lambda x: x[:2])
+        return [event for i,order,event in events]
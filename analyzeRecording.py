@@ -1,89 +1,346 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+"""
+Run the lightning detection over spinningCan.py recordings.
+
+With a single recording, or a directory of recordings and a time range, the
+results are plotted.  With a directory or glob of recordings and --batch
+each recording is analyzed on its own across a pool of worker processes and
+a summary is printed.  Batch results are cached by the contents of the
+recording and the detector settings so that only new or changed recordings
+are analyzed on later runs.
+"""
+
 from __future__ import print_function
 
+import os
 import sys
+import glob
+import json
+import zlib
+import hashlib
+import zipfile
+import tempfile
+import argparse
 try:
     from zoneinfo import ZoneInfo
 except ImportError:
     from backports.zoneinfo import ZoneInfo
 import numpy
 from datetime import datetime
-from matplotlib import pyplot as plt
+from multiprocessing import Pool, cpu_count
 
 from efield import ElectricField
+from alerts import AlertEngine
+from recording import readRecording
+from archive import FieldArchive
 
 # MST7MDT
 UTC = ZoneInfo('UTC')
 MST = ZoneInfo('America/Denver')
 
-# Date formating string
-dateFmt = "%Y-%m-%d %H:%M:%S.%f"
+# Version of the cached results - bump this when the analysis changes
+CACHE_VERSION = 1
+
+# Entries in the cached results
+_CACHE_KEYS = ('samples', 'start', 'stop', 'lightning_times', 'lightning_distances',
+               'event_types', 'event_times', 'event_values', 'parameters')
+
+# Distance in km for a strike to be considered close
+CLOSE_DISTANCE = 15.0
+
+
+def setupDetector(config=None):
+    """
+    Return an ElectricField and AlertEngine setup from the given configuration
+    dictionary, or with the default values if there is none.
+    """
+    
+    movingField = ElectricField()
+    alerts = AlertEngine()
+    if config is not None:
+        movingField.updateConfig(config)
+        alerts.updateConfig(config)
+    return movingField, alerts
+
+
+def detectorParameters(movingField, alerts):
+    """
+    Return a dictionary of everything that affects the results of the
+    analysis.
+    """
+    
+    return {'version': CACHE_VERSION,
+            'nKeep': movingField.nKeep,
+            'highField': movingField.highField,
+            'veryHighField': movingField.veryHighField,
+            'minFieldChange': movingField.minFieldChange,
+            'fieldInterval': alerts.fieldInterval,
+            'fieldClearedInterval': alerts.fieldClearedInterval,
+            'lightningInterval': alerts.lightningInterval,
+            'lightningClearedInterval': alerts.lightningClearedInterval}
+
 
-# Open the file and read it in
-fh = open(sys.argv[1], 'r')
+def hashFile(filename, blockSize=4*1024*1024):
+    """
+    Return the SHA-256 hex digest of the contents of a file.
+    """
+    
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as fh:
+        while True:
+            block = fh.read(blockSize)
+            if not block:
+                break
+            digest.update(block)
+    return digest.hexdigest()
 
-# Create an ElecticField instance to mimic how spinningCan* deals with things
-movingField = ElectricField()
 
-times = []
-fields = []
-lightning = []
-distances = []
-while True:
+def analyzeFile(job):
+    """
+    Analyze a single recording, or load the results from the cache if they
+    are there, and return a dictionary summarizing the results.
+    """
+    
+    filename, config, cacheDir = job
+    movingField, alerts = setupDetector(config)
+    
+    parameters = json.dumps(detectorParameters(movingField, alerts), sort_keys=True)
+    key = "%s-%s" % (hashFile(filename)[:32], hashlib.sha256(parameters.encode()).hexdigest()[:16])
+    cacheFile = os.path.join(cacheDir, key+'.npz')
+    
+    cached = True
     try:
-        # Read a line and split it into a datetime string and a field measurement
-        line = fh.readline()
-        t, f = line.split('  ', 1)
-
-        # Convert the time to datetime object (in MST/MDT) and the field to a float
-        t = datetime.strptime(t, dateFmt).replace(tzinfo=UTC)
-        f, junk = f.split(None, 1)
-        f = float(f)
+        with numpy.load(cacheFile) as npz:
+            results = {name: npz[name] for name in _CACHE_KEYS}
+    except (IOError, OSError, ValueError, KeyError, zipfile.BadZipFile, zlib.error):
+        # Missing, truncated, or corrupt - start over
+        cached = False
+        
+        epochs, fields = readRecording(filename)
+        detection = movingField.detect(epochs, fields)
+        events = alerts.run(movingField, epochs, fields)
+        
+        results = {'samples': numpy.array(epochs.size),
+                   'start': numpy.array(epochs[0] if epochs.size else numpy.nan),
+                   'stop': numpy.array(epochs[-1] if epochs.size else numpy.nan),
+                   'lightning_times': detection.times[detection.lightning],
+                   'lightning_distances': detection.distance[detection.lightning],
+                   'event_types': numpy.array([e.type for e in events], dtype='U9'),
+                   'event_times': numpy.array([e.time for e in events], dtype=numpy.float64),
+                   'event_values': numpy.array([e.values[0] for e in events], dtype=numpy.float64),
+                   'parameters': numpy.array(parameters)}
+        
+        # Save, if we can.  The results are written to a temporary file of
+        # our own so that workers analyzing the same recording do not collide.
+        tmpName = None
+        try:
+            with tempfile.NamedTemporaryFile(dir=cacheDir, prefix='.'+key+'.', suffix='.tmp',
+                                             delete=False) as fh:
+                tmpName = fh.name
+                numpy.savez_compressed(fh, **results)
+            os.rename(tmpName, cacheFile)
+        except (IOError, OSError):
+            if tmpName is not None:
+                try:
+                    os.unlink(tmpName)
+                except OSError:
+                    pass
+            
+    close = results['lightning_distances'] < CLOSE_DISTANCE
+    return {'filename': filename,
+            'cached': cached,
+            'samples': int(results['samples']),
+            'start': float(results['start']),
+            'stop': float(results['stop']),
+            'detections': int(results['lightning_times'].size),
+            'close': int(close.sum()),
+            'reports': int((results['event_types'] == 'LIGHTNING').sum()),
+            'warnings': int((results['event_types'] == 'WARNING').sum())}
+
+
+def expandInputs(names):
+    """
+    Expand a list of recordings, directories, and glob patterns into a sorted
+    list of recordings.  Hidden files in directories are skipped.
+    """
+    
+    filenames = set()
+    for name in names:
+        if os.path.isdir(name):
+            matches = [os.path.join(name, entry) for entry in os.listdir(name) if not entry.startswith('.')]
+        else:
+            matches = glob.glob(name) or [name,]
+        filenames.update([m for m in matches if os.path.isfile(m)])
+    return sorted(filenames)
+
+
+def batch(args, config):
+    """
+    Analyze a collection of recordings across a pool of processes and print
+    a summary.
+    """
+    
+    filenames = expandInputs(args.filename)
+    if not filenames:
+        print("No recordings found")
+        sys.exit(1)
+        
+    if not os.path.exists(args.cache_dir):
+        os.makedirs(args.cache_dir)
         
-        # Save - part 1
-        times.append(t)
-        fields.append(f)
+    jobs = [(filename, config, args.cache_dir) for filename in filenames]
+    totals = {'samples': 0, 'detections': 0, 'close': 0, 'reports': 0, 'warnings': 0, 'cached': 0}
+    with Pool(processes=min(args.processes, len(jobs))) as pool:
+        for summary in pool.imap(analyzeFile, jobs):
+            if summary['samples']:
+                span = "%s to %s" % (datetime.fromtimestamp(summary['start'], UTC).strftime("%Y-%m-%d %H:%M:%S"),
+                                     datetime.fromtimestamp(summary['stop'], UTC).strftime("%Y-%m-%d %H:%M:%S"))
+            else:
+                span = "empty"
+            cached = ' (cached)' if summary['cached'] else ''
+            print("%s: %s, %i detections (%i within %.0f km), %i reports, %i warnings%s" \
+                  % (summary['filename'], span, summary['detections'], summary['close'], CLOSE_DISTANCE,
+                     summary['reports'], summary['warnings'], cached))
+            for key in totals:
+                totals[key] += int(summary[key])
+                
+    print("Total: %i recordings (%i cached), %i samples, %i detections (%i within %.0f km), %i reports, %i warnings" \
+          % (len(jobs), totals['cached'], totals['samples'], totals['detections'], totals['close'], CLOSE_DISTANCE,
+             totals['reports'], totals['warnings']))
+
+
+def decimate(times, values, nBins):
+    """
+    Reduce a time series to the minimum and maximum values in each of `nBins`
+    equal width time bins so that it can be drawn at screen resolution
+    without losing any spikes.  Returns the decimated times and values.
+    Empty bins are dropped.
+    """
+    
+    if times.size <= 2*nBins:
+        return times, values
         
-        # Save - part 2
-        movingField.append(t, f)
-        if movingField.isLightning():
-            lightning.append(t)
-            distances.append( movingField.getLightningDistance() )
-
-    except Exception as e:
-        print("Reading ends with: %s" % str(e))
-        break
-fh.close()
-
-# Convert the list of field strengths in kV/m to a numpy array
-fields = numpy.array(fields)
-
-# Boxcar smooth the field with a three sample window
-fields2 = fields*0
-for i in xrange(2,len(fields)):
-    fields2[i] = (fields[i-2] + fields[i-1] + fields[i]) / 3.0
-#fields = fields2
-
-# Differentiation
-deltas = fields - numpy.roll(fields, 7)
-
-# Plots
-fig = plt.figure()
-ax = fig.gca()
-ax.plot_date(times, fields,  color='blue')
-ax.plot_date(times, deltas,  color='red')
-
-for t,d in zip(lightning, distances):
-    if d < 15:
-        print(str(t.astimezone(MST)), "%.1f" % d)
-    ax.vlines(t, -20, 20, color='red', linestyle='--')
-ax.set_ylim([-20, 20])
-
-ax.set_title('spinningCan.py Recording "%s"' % sys.argv[1])
-ax.set_xlabel('Time')
-ax.set_ylabel('Electric Field [kV/m]')
-fig.autofmt_xdate()
-plt.show()
+    bins = ((times - times[0]) * (nBins / (times[-1] - times[0] + 1e-9))).astype(numpy.int64)
+    starts = numpy.flatnonzero(numpy.diff(bins, prepend=-1))
+    
+    dtimes = numpy.repeat(times[starts], 2)
+    dvalues = numpy.empty(dtimes.size, dtype=values.dtype)
+    dvalues[0::2] = numpy.minimum.reduceat(values, starts)
+    dvalues[1::2] = numpy.maximum.reduceat(values, starts)
+    return dtimes, dvalues
+
+
+def plot(args, config):
+    """
+    Analyze a single recording, or a time range from a directory of
+    recordings, and plot the results.  The plot is shown on the screen or,
+    if there is an output file, saved to it.
+    """
+    
+    if args.output is not None:
+        import matplotlib
+        matplotlib.use('Agg')
+    from matplotlib import pyplot as plt
+
+    # Read in the recording
+    if os.path.isdir(args.filename[0]):
+        epochs, fields = FieldArchive(args.filename[0]).query(args.start, args.stop)
+    else:
+        epochs, fields = readRecording(args.filename[0])
+    fields = numpy.asarray(fields, dtype=numpy.float64)
+
+    # Create an ElecticField instance to mimic how spinningCan* deals with things
+    movingField, alerts = setupDetector(config)
+
+    # Run the detection over the entire recording
+    results = movingField.detect(epochs, fields)
+    lightning = results.times[results.lightning]
+    distances = results.distance[results.lightning]
+
+    # Boxcar smooth the field with a three sample window
+    fields2 = fields*0
+    fields2[2:] = (fields[:-2] + fields[1:-1] + fields[2:]) / 3.0
+    #fields = fields2
+
+    # Differentiation
+    deltas = fields - numpy.roll(fields, 7)
+
+    for t,d in zip(lightning[distances < CLOSE_DISTANCE], distances[distances < CLOSE_DISTANCE]):
+        print(str(datetime.fromtimestamp(t, MST)), "%.1f" % d)
+        
+    # Decimate everything to one or two points per pixel
+    def toDatetime(t):
+        return numpy.round(t*1e6).astype(numpy.int64).astype('datetime64[us]')
+        
+    ftimes, fields = decimate(epochs, fields, args.width)
+    dtimes, deltas = decimate(epochs, deltas, args.width)
+    if lightning.size and epochs.size > 1:
+        pixels = ((lightning - epochs[0]) * (args.width / (epochs[-1] - epochs[0] + 1e-9))).astype(numpy.int64)
+        lightning = lightning[numpy.unique(pixels, return_index=True)[1]]
+        
+    # Plots
+    fig = plt.figure(figsize=(args.width/100.0, 6), dpi=100)
+    ax = fig.gca()
+    ax.plot(toDatetime(ftimes), fields, color='blue', linewidth=0.5)
+    ax.plot(toDatetime(dtimes), deltas, color='red', linewidth=0.5)
+    if lightning.size:
+        ax.vlines(toDatetime(lightning), -20, 20, color='red', linestyle='--')
+    ax.set_ylim([-20, 20])
+
+    ax.set_title('spinningCan.py Recording "%s"' % args.filename[0])
+    ax.set_xlabel('Time')
+    ax.set_ylabel('Electric Field [kV/m]')
+    fig.autofmt_xdate()
+    if args.output is not None:
+        fig.savefig(args.output)
+    else:
+        plt.show()
+
+
+def main(args):
+    config = None
+    if args.config_file is not None:
+        import json_minify
+        with open(args.config_file, 'r') as ch:
+            config = json.loads(json_minify.json_minify(ch.read()))
+            
+    if args.batch:
+        batch(args, config)
+    else:
+        plot(args, config)
+
 
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='run lightning detection over a spinningCan.py recording and plot the results',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+            )
+    parser.add_argument('filename', type=str, nargs='+',
+                        help='recording to analyze or a directory of recordings to search; in batch mode, any number of recordings, directories, or glob patterns')
+    parser.add_argument('-s', '--start', type=str,
+                        help='UTC start time, e.g. "2026-07-21 14:02:00", when searching a directory')
+    parser.add_argument('-e', '--stop', type=str,
+                        help='UTC stop time when searching a directory')
+    parser.add_argument('-c', '--config-file', type=str,
+                        help='configuration file with the detector settings to use instead of the defaults')
+    parser.add_argument('-b', '--batch', action='store_true',
+                        help='analyze each recording separately and print a summary instead of plotting')
+    parser.add_argument('-p', '--processes', type=int, default=cpu_count(),
+                        help='number of worker processes to use in batch mode')
+    parser.add_argument('-d', '--cache-dir', type=str,
+                        default=os.path.join(os.path.expanduser('~'), '.cache', 'spinningCan'),
+                        help='directory to cache the batch mode results in')
+    parser.add_argument('-o', '--output', type=str,
+                        help='save the plot to this image file, e.g. a PNG, instead of showing it; no display is needed')
+    parser.add_argument('-w', '--width', type=int, default=1600,
+                        help='width of the plot in pixels; the data are decimated to this resolution')
+    args = parser.parse_args()
+    if not args.batch:
+        if len(args.filename) != 1:
+            parser.error("only one recording can be plotted at a time; use --batch for more")
+        if os.path.isdir(args.filename[0]) and (args.start is None or args.stop is None):
+            parser.error("a start and stop time are needed when searching a directory")
+            
+    main(args)
@@ -0,0 +1,287 @@
+"""
+Module for finding the raw electric field values for an arbitrary time range
+in a directory of spinningCan.py recordings, including the older copies left
+behind by logrotate (field.log.1, field.log.2.gz, ...).
+
+Each recording is catalogued with the time range it covers and, for text
+recordings, a set of checkpoints that map time stamps to byte offsets in the
+uncompressed file.  Queries only read the recordings that overlap the
+requested range and, within those, start reading at the last checkpoint
+before the range.  For uncompressed text files this is a direct seek.  gzip
+files do not support random access so seeking within them still requires
+decompressing up to the checkpoint but skips the parsing.  Binary recordings
+use their fixed width records and a binary search instead of checkpoints.
+
+The catalogue is saved in the directory as a hidden JSON file so that it
+only needs to be built once per recording.
+"""
+
+import os
+import re
+import json
+import numpy
+from bisect import bisect_right
+from datetime import datetime, timezone
+
+from recording import openRecording, isBinaryRecording, readBinaryRecording, recordValid, \
+                      parseTextLine, readTextRecording
+
+__version__ = "0.1"
+__all__ = ['parseTime', 'FieldArchive',]
+
+
+# Default spacing between checkpoints in bytes of the uncompressed recording
+_CHECKPOINT_INTERVAL = 1024*1024
+
+# Chunk size in bytes for scanning text recordings
+_CHUNK_SIZE = 4*1024*1024
+
+
+def parseTime(value):
+    """
+    Convert a datetime instance (naive values are assumed to be in UTC), a
+    UNIX epoch, or an ISO 8601-like string such as "2026-07-21 14:02:00"
+    into a UNIX epoch in seconds.
+    """
+    
+    if isinstance(value, str):
+        try:
+            return float(value)
+        except ValueError:
+            value = datetime.fromisoformat(value)
+    try:
+        return value.replace(tzinfo=value.tzinfo or timezone.utc).timestamp()
+    except AttributeError:
+        return float(value)
+
+
+def _lastTime(lines):
+    """
+    Return the UNIX epoch of the last line in a block of complete text
+    recording lines that can be parsed, or None if there are none.
+    """
+    
+    end = len(lines) - 1
+    while end > 0:
+        start = lines.rfind(b'\n', 0, end) + 1
+        entry = parseTextLine(lines[start:end])
+        if entry is not None:
+            return entry[0]
+        end = start - 1
+    return None
+
+
+def _indexText(filename, entry, interval=_CHECKPOINT_INTERVAL):
+    """
+    Scan a text recording starting at entry['end'] and update the entry with
+    the time range covered and the checkpoints.
+    """
+    
+    offset = entry['end']
+    nextCheck = offset
+    if entry['checkpoints']:
+        nextCheck = entry['checkpoints'][-1][1] + interval
+        
+    with openRecording(filename) as fh:
+        fh.seek(offset)
+        leftover = b''
+        while True:
+            data = fh.read(_CHUNK_SIZE)
+            if not data:
+                break
+            chunk = leftover + data
+            last = chunk.rfind(b'\n')
+            if last < 0:
+                leftover = chunk
+                continue
+            lines, leftover = chunk[:last+1], chunk[last+1:]
+            
+            # Add checkpoints at the first parsable line at or after each
+            # interval
+            while nextCheck < offset + len(lines):
+                pos = max(nextCheck - offset, 0)
+                if pos > 0:
+                    pos = lines.find(b'\n', pos-1) + 1
+                t = None
+                while pos < len(lines):
+                    end = lines.find(b'\n', pos)
+                    t = parseTextLine(lines[pos:end])
+                    if t is not None:
+                        break
+                    pos = end + 1
+                    
+                if t is None:
+                    nextCheck = offset + len(lines)
+                else:
+                    entry['checkpoints'].append((t[0], offset+pos))
+                    if entry['start'] is None:
+                        entry['start'] = t[0]
+                    nextCheck = offset + pos + interval
+                    
+            # Update the end of the time range
+            t = _lastTime(lines)
+            if t is not None:
+                entry['stop'] = t
+                
+            offset += len(lines)
+            
+    entry['end'] = offset
+
+
+class FieldArchive(object):
+    """
+    Class to catalogue and query a directory of text and/or binary
+    recordings made by spinningCan.py.
+    """
+    
+    def __init__(self, directory, basename='field.log', checkpointInterval=_CHECKPOINT_INTERVAL):
+        self.directory = directory
+        self.basename = basename
+        self.checkpointInterval = int(checkpointInterval)
+        
+        self._indexFile = os.path.join(self.directory, '.%s.index' % self.basename)
+        self._fileRE = re.compile(r'^%s(\.(?P<number>\d+))?(\.gz)?$' % re.escape(self.basename))
+        
+        # Catalogue entries keyed by inode so that they survive the renames
+        # done by logrotate
+        try:
+            with open(self._indexFile, 'r') as fh:
+                self._catalogue = json.load(fh)
+        except (IOError, OSError, ValueError):
+            self._catalogue = {}
+            
+    def _files(self):
+        """
+        Return a list of the recordings in the directory, newest first.
+        """
+        
+        found = []
+        for name in os.listdir(self.directory):
+            mtch = self._fileRE.match(name)
+            if mtch is not None:
+                found.append((int(mtch.group('number') or 0), os.path.join(self.directory, name)))
+        found.sort()
+        return [filename for number,filename in found]
+        
+    def _save(self):
+        """
+        Save the catalogue, if we can.
+        """
+        
+        try:
+            with open(self._indexFile+'.tmp', 'w') as fh:
+                json.dump(self._catalogue, fh)
+            os.rename(self._indexFile+'.tmp', self._indexFile)
+        except (IOError, OSError):
+            pass
+            
+    def _entry(self, filename):
+        """
+        Return an up-to-date catalogue entry for the specified recording.
+        """
+        
+        st = os.stat(filename)
+        key = str(st.st_ino)
+        entry = self._catalogue.get(key, None)
+        
+        with open(filename, 'rb') as fh:
+            head = fh.read(64).hex()
+        gzipped = head.startswith('1f8b')
+        
+        if entry is not None and entry['head'] == head:
+            if entry['size'] == st.st_size and entry['mtime'] == st.st_mtime:
+                # Nothing has changed
+                return entry
+            elif not gzipped and not entry['binary'] and st.st_size > entry['size']:
+                # The recording has grown - pick up where we left off
+                entry['size'] = st.st_size
+                entry['mtime'] = st.st_mtime
+                _indexText(filename, entry, interval=self.checkpointInterval)
+                return entry
+                
+        entry = {'head': head, 'size': st.st_size, 'mtime': st.st_mtime,
+                 'binary': isBinaryRecording(filename),
+                 'start': None, 'stop': None, 'end': 0, 'checkpoints': []}
+        if entry['binary']:
+            records = readBinaryRecording(filename)
+            if len(records):
+                entry['start'] = float(records['time'][0])
+                entry['stop'] = float(records['time'][-1])
+        else:
+            _indexText(filename, entry, interval=self.checkpointInterval)
+        self._catalogue[key] = entry
+        return entry
+        
+    def update(self):
+        """
+        Bring the catalogue up to date with what is in the directory and return
+        a list of (filename, start, stop) tuples, oldest first, where start and
+        stop are UNIX epochs.  Empty recordings are not included.
+        """
+        
+        recordings = []
+        seen = set()
+        for filename in self._files():
+            entry = self._entry(filename)
+            seen.add(str(os.stat(filename).st_ino))
+            if entry['start'] is not None:
+                recordings.append((filename, entry['start'], entry['stop']))
+                
+        # Forget about anything that has been rotated away
+        for key in list(self._catalogue.keys()):
+            if key not in seen:
+                del self._catalogue[key]
+        self._save()
+        
+        recordings.sort(key=lambda x: x[1])
+        return recordings
+        
+    def span(self):
+        """
+        Return a two-element tuple of the first and last UNIX epochs in the
+        archive, or (None, None) if it is empty.
+        """
+        
+        recordings = self.update()
+        if not recordings:
+            return None, None
+        return min(r[1] for r in recordings), max(r[2] for r in recordings)
+        
+    def query(self, start, stop):
+        """
+        Return a two-element tuple of the UNIX epochs and electric field values
+        in kV/m as numpy arrays for all valid samples with start <= t < stop.
+        `start` and `stop` can be anything understood by parseTime().
+        """
+        
+        start, stop = parseTime(start), parseTime(stop)
+        
+        times, fields = [], []
+        for filename,first,last in self.update():
+            if last < start or first >= stop:
+                continue
+            entry = self._entry(filename)
+            
+            if entry['binary']:
+                records = readBinaryRecording(filename)
+                i, j = numpy.searchsorted(records['time'], [start, stop])
+                records = records[i:j]
+                records = records[recordValid(records)]
+                t, f = records['time'], records['field']
+            else:
+                checkTimes = [c[0] for c in entry['checkpoints']]
+                i = max(bisect_right(checkTimes, start) - 1, 0)
+                j = bisect_right(checkTimes, stop)
+                offset = entry['checkpoints'][i][1]
+                size = entry['end'] - offset
+                if j < len(checkTimes):
+                    size = entry['checkpoints'][j][1] - offset
+                t, f = readTextRecording(filename, offset=offset, size=size)
+                
+            valid = (t >= start) & (t < stop)
+            times.append(t[valid])
+            fields.append(f[valid])
+            
+        if not times:
+            return numpy.zeros(0), numpy.zeros(0)
+        return numpy.concatenate(times), numpy.concatenate(fields).astype(numpy.float64)
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark the EFM-100 sentence parsers in efm100.py against the original
+regular expression based parser from spinningCan.py.
+"""
+
+import re
+import timeit
+import argparse
+
+from efm100 import parseField, parseFields
+
+# The original regular expression based parser
+fieldRE = re.compile(r'\$(?P<field>[-+]\d{2}\.\d{2}),(?P<status>\d)\*(?P<checksum>[0-9A-F]{2})')
+
+
+def computeChecksumRE(text):
+    cSum = 0
+    for c in text[:10]:
+        cSum += ord(c)
+        cSum %= 256
+        
+    return "%2X" % cSum
+
+
+def parseFieldRE(text):
+    mtch = fieldRE.match(text)
+    
+    try:
+        field = float(mtch.group('field'))
+        status = int(mtch.group('status'))
+        valid = True if mtch.group('checksum') == computeChecksumRE(text) else False
+    except:
+        field = 0.0
+        status = 2
+        valid = False
+        
+    return field, status, valid
+
+
+def buildSentence(field, status=0):
+    """
+    Build a EFM-100 sentence for the given field and status code.
+    """
+    
+    body = "$%+06.2f,%i*" % (field, status)
+    return "%s%02X\r\n" % (body, sum(bytearray(body, 'ascii')) & 0xFF)
+
+
+def main(args):
+    # Build a set of test sentences
+    texts = [buildSentence(((i*37) % 4001 - 2000)/100.0, i % 2) for i in range(args.n_sentence)]
+    sentences = [text.encode('ascii') for text in texts]
+    block = b''.join(sentences)
+    
+    # Make sure everyone agrees, ignoring the checksums that the original
+    # parser gets wrong because of the "%2X" formatting
+    for text,sentence in zip(texts, sentences):
+        old = parseFieldRE(text)
+        new = parseField(sentence)
+        if old[:2] != new[:2] or (old[2] != new[2] and text[10] != '0'):
+            raise RuntimeError("Parser mismatch on %s: %s != %s" % (repr(text), old, new))
+    fields, status, valid = parseFields(block)
+    if list(fields) != [parseField(s)[0] for s in sentences] or not valid.all():
+        raise RuntimeError("Batch parser mismatch")
+        
+    # Time them
+    print("Parsing %i sentences, best of %i:" % (args.n_sentence, args.repeat))
+    tRE = min(timeit.repeat(lambda: [parseFieldRE(t) for t in texts], number=1, repeat=args.repeat))
+    print("  regular expression: %7.3f us/sentence" % (tRE/args.n_sentence*1e6,))
+    tFixed = min(timeit.repeat(lambda: [parseField(s) for s in sentences], number=1, repeat=args.repeat))
+    print("  fixed offset:       %7.3f us/sentence (%.1fx)" % (tFixed/args.n_sentence*1e6, tRE/tFixed))
+    tBatch = min(timeit.repeat(lambda: parseFields(block), number=1, repeat=args.repeat))
+    print("  batch:              %7.3f us/sentence (%.1fx)" % (tBatch/args.n_sentence*1e6, tRE/tBatch))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='benchmark the EFM-100 sentence parsers',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+            )
+    parser.add_argument('-n', '--n-sentence', type=int, default=72000,
+                        help='number of sentences to parse')
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help='number of times to repeat each timing')
+    args = parser.parse_args()
+    
+    main(args)
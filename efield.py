@@ -8,9 +8,31 @@ analyzeRecodring.py to make sure they are all on the same page.
 """
 
 import numpy
+from collections import namedtuple
+from datetime import timezone
 
-__version__ = "0.2"
-__all__ = ['ElectricField',]
+__version__ = "0.3"
+__all__ = ['DetectionResult', 'ElectricField',]
+
+
+_UTC = timezone.utc
+
+
+# Container for the output of ElectricField.detect
+DetectionResult = namedtuple('DetectionResult', ['times', 'field', 'mean', 'smoothed', 'deriv', 
+                                                 'high', 'veryHigh', 'lightning', 'distance'])
+
+
+def _toEpoch(time):
+    """
+    Convert a datetime instance (naive values are assumed to be in UTC) or
+    a UNIX epoch into a UNIX epoch in seconds.
+    """
+    
+    try:
+        return time.replace(tzinfo=time.tzinfo or _UTC).timestamp()
+    except AttributeError:
+        return float(time)
 
 
 class ElectricField(object):
@@ -34,12 +56,53 @@ class ElectricField(object):
         # Lightning detection control values
         self.minFieldChange = float(minFieldChange)
         
-        # Field retention control
-        self.nKeep = int(nKeep)
+        # Internal ring buffers to store the time/field pairs.  `_head` points
+        # to the slot that the next sample will be written to and `_total` is
+        # the running sum of the retained field values.
+        self._resize(int(nKeep))
+        
+    def _resize(self, nKeep):
+        """
+        (Re)allocate the internal ring buffers to hold `nKeep` samples, 
+        carrying over as much of the retained history as will fit.
+        """
+        
+        try:
+            times, field = self.times, self.field
+        except AttributeError:
+            times, field = numpy.zeros(0), numpy.zeros(0)
+        times, field = times[-nKeep:], field[-nKeep:]
+        
+        self.nKeep = nKeep
+        self._times = numpy.zeros(self.nKeep, dtype=numpy.float64)
+        self._field = numpy.zeros(self.nKeep, dtype=numpy.float64)
+        self._count = len(field)
+        self._times[:self._count] = times
+        self._field[:self._count] = field
+        self._head = self._count % self.nKeep
+        self._total = float(field.sum())
+        
+    @property
+    def times(self):
+        """
+        Retained time stamps as a numpy.float64 array of UNIX epoch seconds,
+        oldest first.
+        """
+        
+        if self._count < self.nKeep:
+            return self._times[:self._count].copy()
+        return numpy.roll(self._times, -self._head)
+        
+    @property
+    def field(self):
+        """
+        Retained electric field values in kV/m as a numpy.float64 array,
+        oldest first.
+        """
         
-        # Internal data structures to store the time/field pairs.
-        self.times = []
-        self.field = []
+        if self._count < self.nKeep:
+            return self._field[:self._count].copy()
+        return numpy.roll(self._field, -self._head)
         
     def updateConfig(self, config):
         """
@@ -59,10 +122,10 @@ class ElectricField(object):
         
         # Update values
         ## Data retention
-        self.nKeep = int(round(20.0*float(config['efield']['average_time'])))
-        if self.nKeep < 7:
-            self.nKeep = 7
-        
+        nKeep = int(round(20.0*float(config['efield']['average_time'])))
+        if nKeep < 7:
+            nKeep = 7
+            
         ## Field control
         self.highField = float(config['efield']['high_field'] )
         self.veryHighField = float(config['efield']['very_high_field'])
@@ -70,66 +133,87 @@ class ElectricField(object):
         ## Lightning control
         self.minFieldChange = float(config['lightning']['min_efield_change'])
         
-        # Prune
-        self.times = self.times[-self.nKeep:]
-        self.field = self.field[-self.nKeep:]
-
+        # Resize, keeping the most recent history
+        if nKeep != self.nKeep:
+            self._resize(nKeep)
+            
     def append(self, time, data):
         """
         Append a new time stamp/electric field value (in kV/m) pair to the
-        instance.
+        instance.  The time stamp can either be a datetime instance (naive
+        values are assumed to be in UTC) or a UNIX epoch in seconds.
         """
         
         try:
-            self.times.append(time)
-            self.field.append(data)
-
-            self.times = self.times[-self.nKeep:]
-            self.field = self.field[-self.nKeep:]
+            time = _toEpoch(time)
+            data = float(data)
+            
+            i = self._head
+            if self._count == self.nKeep:
+                self._total -= self._field[i]
+            else:
+                self._count += 1
+            self._times[i] = time
+            self._field[i] = data
+            self._total += data
             
+            self._head = (i + 1) % self.nKeep
+            if self._head == 0:
+                # Once per trip around the buffer, refresh the running sum to
+                # keep floating point errors from accumulating.
+                self._total = float(self._field[:self._count].sum())
+                
             return True
         except:
             return False
-
+            
+    def _last(self, k):
+        """
+        Return the field value `k` samples back from the most recent one, 
+        i.e., k=1 is the most recent value.
+        """
+        
+        return float(self._field[(self._head - k) % self.nKeep])
+        
+    def lastTime(self):
+        """
+        Return the time stamp of the most recent value as a UNIX epoch in
+        seconds.
+        """
+        
+        return float(self._times[(self._head - 1) % self.nKeep])
+        
     def mean(self):
         """
         Determine the current mean of the electric field and return the value
         in kV/m.
         """
         
-        n = 0
-        total = 0
-        for data in self.field:
-            n += 1
-            total += data
+        return self._total / float(self._count)
         
-        return total / float(n)
-
-    def __smooth(self, i):
+    def __smooth(self, k):
         """
         Perform a simple backwards boxcar smoothing of the data with a window
-        of three at the specified location.
+        of three at the specified location, counted back from the most recent
+        value.
         """
         
-        n = 1
-        smoothData = self.field[i]
-        try:
-            n += 1
-            smoothData += self.field[i-1]
-            n += 1
-            smoothData += self.field[i-2]
-        except IndexError:
-            n -= 1
-
+        smoothData = self._last(k)
+        n = min(3, self._count - k + 1)
+        if n > 1:
+            smoothData += self._last(k+1)
+        if n > 2:
+            smoothData += self._last(k+2)
+            
         return smoothData/float(n)
-
+        
     def deriv(self):
         """
         Compute and return the derivative over a ~0.3 s window (6 samples).
         """
         
-        if len(self.field) > 6:
-            return self.__smooth(-1) - self.__smooth(-7)
+        if self._count > 6:
+            return self.__smooth(1) - self.__smooth(7)
         else:
             return 0.0
             
@@ -139,7 +223,7 @@ class ElectricField(object):
         condition or not.
         """
         
-        if abs(self.field[-1] ) > self.highField:
+        if abs(self._last(1)) > self.highField:
             return True
         else:
             return False
@@ -150,11 +234,11 @@ class ElectricField(object):
         field` condition or not.
         """
         
-        if abs(self.field[-1] ) > self.veryHighField:
+        if abs(self._last(1)) > self.veryHighField:
             return True
         else:
             return False
-
+            
     def isLightning(self):
         """
         Examine the current field list and determine if we have what looks like
@@ -181,3 +265,88 @@ class ElectricField(object):
             return dist*0.621371192
         else:
             return dist
+            
+    def detect(self, times, fields, miles=False):
+        """
+        Run the lightning detection over an entire sequence of time stamp/
+        electric field value (in kV/m) pairs at once.  The smoothed, deriv,
+        high, veryHigh, lightning, and distance outputs are exactly the same
+        as feeding the values one at a time through append() into an empty
+        instance with the same configuration and calling deriv(), isHigh(),
+        isVeryHigh(), isLightning(), and getLightningDistance() after each
+        one.  The mean output is computed from a running sum and so only
+        matches mean() to within floating-point rounding (~1e-10 kV/m).  The
+        internal buffer is not touched.
+        
+        Returns a DetectionResult of numpy arrays, one entry per sample:
+          * times - time stamps as UNIX epoch seconds
+          * field - electric field in kV/m
+          * mean - mean field over the averaging window in kV/m
+          * smoothed - three sample boxcar smoothed field in kV/m
+          * deriv - derivative over a ~0.3 s window in kV/m
+          * high - whether or not the field is high
+          * veryHigh - whether or not the field is very high
+          * lightning - whether or not lightning was detected
+          * distance - estimated lightning distance in km (or miles if 
+            `miles` is True); NaN where there is no lightning
+        """
+        
+        times = numpy.asarray(times)
+        if times.dtype.kind not in ('f', 'i', 'u'):
+            times = numpy.array([_toEpoch(t) for t in times.ravel()])
+        times = times.astype(numpy.float64).ravel()
+        field = numpy.asarray(fields, dtype=numpy.float64).ravel()
+        if times.size != field.size:
+            raise ValueError("Time and field arrays must be the same length")
+            
+        # How many samples the streaming buffer would hold at each point
+        n = field.size
+        count = numpy.minimum(numpy.arange(1, n+1), self.nKeep)
+        
+        # Running mean over the averaging window
+        cs = numpy.zeros(n+1)
+        numpy.cumsum(field, out=cs[1:])
+        mean = (cs[1:] - cs[numpy.arange(1, n+1) - count]) / count
+        
+        # Boxcar smoothing at the most recent sample and six samples back.
+        # The order of the operations follows __smooth exactly.
+        smoothed = self.__boxcar(field, 0, numpy.minimum(3, count))
+        back = self.__boxcar(field, 6, numpy.clip(count - 6, 1, 3))
+        
+        deriv = numpy.zeros(n)
+        valid = count > 6
+        deriv[valid] = smoothed[valid] - back[valid]
+        
+        high = numpy.abs(field) > self.highField
+        veryHigh = numpy.abs(field) > self.veryHighField
+        lightning = numpy.abs(deriv) > self.minFieldChange
+        
+        # Distances are only computed where there is lightning.  This is done
+        # one value at a time since numpy.power can differ from the C library 
+        # pow() used by getLightningDistance in the last bit.
+        distance = numpy.full(n, numpy.nan)
+        for i in numpy.where(lightning)[0]:
+            distance[i] = (10.0/abs(float(deriv[i])))**(1/3.) * 5
+        if miles:
+            distance *= 0.621371192
+            
+        return DetectionResult(times, field, mean, smoothed, deriv, 
+                               high, veryHigh, lightning, distance)
+        
+    @staticmethod
+    def __boxcar(field, offset, width):
+        """
+        Vectorized version of __smooth.  For each sample i, average `width[i]`
+        values ending at sample i-offset.  Entries with i-offset < 0 are left
+        as zero.
+        """
+        
+        smoothData = numpy.zeros(field.size)
+        smoothData[offset:] = field[:field.size-offset]
+        for w in (2, 3):
+            shift = offset + w - 1
+            use = numpy.where(width[shift:] >= w)[0] + shift
+            smoothData[use] += field[use - shift]
+        smoothData /= numpy.where(width > 0, width, 1)
+        
+        return smoothData
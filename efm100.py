@@ -0,0 +1,216 @@
+"""
+Module for reading and parsing the serial data stream from a Boltek EFM-100
+atmospheric electric field monitor.
+
+Used by spinningCan.py to turn the raw serial port data into electric field
+values.
+"""
+
+import numpy
+
+__version__ = "0.2"
+__all__ = ['SENTENCE_SIZE', 'computeChecksum', 'parseField', 'parseFields', 'SentenceReader',]
+
+
+# Size of a complete EFM-100 sentence, including the trailing <cr><lf>
+SENTENCE_SIZE = 14
+
+# Longest stretch of data we will wait on for the end of a sentence before
+# giving up on it
+_MAX_FRAME_SIZE = 4*SENTENCE_SIZE
+
+# Lookup tables for converting bytes into digit, hex digit, and sign values.
+# Anything that is not valid maps to -1 (or 0 for the sign).
+_DIGIT = [-1]*256
+_HEX = [-1]*256
+for _i,_c in enumerate(b'0123456789'):
+    _DIGIT[_c] = _i
+    _HEX[_c] = _i
+for _i,_c in enumerate(b'ABCDEF'):
+    _HEX[_c] = 10 + _i
+    _HEX[_c+32] = 10 + _i
+_SIGN = [0]*256
+_SIGN[ord('+')] = 1
+_SIGN[ord('-')] = -1
+
+# numpy versions of the lookup tables for parseFields
+_DIGIT_TABLE = numpy.array(_DIGIT, dtype=numpy.int16)
+_HEX_TABLE = numpy.array(_HEX, dtype=numpy.int16)
+_SIGN_TABLE = numpy.array(_SIGN, dtype=numpy.int16)
+
+# Sum of the fixed characters in a sentence, '$', '.', ',' and '*', for the
+# checksum
+_FIXED_SUM = ord('$') + ord('.') + ord(',') + ord('*')
+
+# Layout of a sentence
+_SENTENCE = numpy.frombuffer(b'$+dd.dd,d*hh', dtype=numpy.uint8)
+_FIXED_COLUMNS = [0, 4, 7, 9]
+_DIGIT_COLUMNS = [2, 3, 5, 6, 8]
+
+
+def computeChecksum(data):
+    """
+    Compute the checksum for the output sentence using the first 10 bytes and 
+    return it as an integer.
+    """
+    
+    return sum(bytearray(data[:10])) & 0xFF
+
+
+def parseField(data):
+    """
+    Parse the output sentence with the format:
+      $<p><ee.ee>,<f>*<cs><cr><lf>
+      
+      <p> - polarity of electric field + or -
+      <ee.ee> - electric field level 00.00 to 20.00
+      <f> - fault 0: Normal, 1: Rotor Fault
+      <cs> - checksum in hex 00 to FF
+      <cr> - carriage return
+      <lf> - line feed
+      
+    And return a three-element tuple of the field value, status code, and 
+    a boolean of whether or not the data are valid.
+    
+    The sentence should be a bytes-like object (str is accepted as well) and
+    is decoded using the fixed positions of the various parts.
+    """
+    
+    if isinstance(data, str):
+        data = data.encode('ascii', errors='replace')
+        
+    try:
+        if data[0] != 36 or data[4] != 46 or data[7] != 44 or data[9] != 42:
+            raise ValueError
+        sign = _SIGN[data[1]]
+        d1, d2, d3, d4 = _DIGIT[data[2]], _DIGIT[data[3]], _DIGIT[data[5]], _DIGIT[data[6]]
+        status = _DIGIT[data[8]]
+        checksum = (_HEX[data[10]] << 4) | _HEX[data[11]]
+        if (d1 | d2 | d3 | d4 | status | checksum) < 0 or sign == 0:
+            raise ValueError
+    except (IndexError, ValueError):
+        return 0.0, 2, False
+        
+    field = (((d1*10 + d2)*10 + d3)*10 + d4) / 100.0
+    if sign < 0:
+        field = -field
+    cSum = (_FIXED_SUM + data[1] + data[2] + data[3] + data[5] + data[6] + data[8]) & 0xFF
+    
+    return field, status, cSum == checksum
+
+
+def parseFields(data):
+    """
+    Parse a bytes-like object containing any number of sentences and return 
+    a three-element tuple of numpy arrays of the field values, status codes,
+    and whether or not each sentence is valid.  Sentences are located by their
+    leading '$' and anything in between them is ignored.  Sentences that 
+    cannot be parsed are returned as a field of 0.0 with a status code of 2,
+    the same as parseField().
+    """
+    
+    data = numpy.frombuffer(data, dtype=numpy.uint8)
+    starts = numpy.where(data == ord('$'))[0]
+    starts = starts[starts + len(_SENTENCE) <= len(data)]
+    sentences = data[starts[:,None] + numpy.arange(len(_SENTENCE))]
+    
+    digits = _DIGIT_TABLE[sentences[:,_DIGIT_COLUMNS]]
+    sign = _SIGN_TABLE[sentences[:,1]]
+    checksum = (_HEX_TABLE[sentences[:,10]] << 4) | _HEX_TABLE[sentences[:,11]]
+    good = (sentences[:,_FIXED_COLUMNS] == _SENTENCE[_FIXED_COLUMNS]).all(axis=1)
+    good &= (digits >= 0).all(axis=1) & (sign != 0) & (checksum >= 0)
+    
+    value = ((digits[:,0]*10 + digits[:,1])*10 + digits[:,2])*10 + digits[:,3]
+    fields = value / 100.0
+    fields = numpy.where(sign < 0, -fields, fields)
+    fields[~good] = 0.0
+    status = numpy.where(good, digits[:,4], 2)
+    cSum = sentences[:,:10].sum(axis=1, dtype=numpy.int32) & 0xFF
+    valid = good & (cSum == checksum)
+    
+    return fields, status, valid
+
+
+class SentenceReader(object):
+    """
+    Class to pull complete sentences out of the EFM-100 serial data stream.
+    Data are read from the port in as large of blocks as are available and
+    accumulated in a buffer that is scanned for '$...<lf>' frames.  If the
+    stream slips the reader resynchronizes on the next '$' already in the
+    buffer rather than going back to the port one byte at a time.
+    
+    Iterating over an instance yields (field, status, valid) tuples from
+    parseField() forever.
+    """
+    
+    def __init__(self, port):
+        self.port = port
+        self.buffer = bytearray()
+        
+    def _fill(self):
+        """
+        Read whatever is waiting on the port, or enough to finish the current
+        sentence if nothing is, and add it to the buffer.  Returns the number of
+        bytes read, which is zero if the port timed out.
+        """
+        
+        try:
+            waiting = self.port.in_waiting
+        except AttributeError:
+            waiting = 0
+        data = self.port.read(max(waiting, SENTENCE_SIZE - len(self.buffer), 1))
+        self.buffer += data.replace(b'\x00', b'')
+        return len(data)
+        
+    def frames(self):
+        """
+        Scan the buffer and return a list of all of the complete sentences in
+        it as bytes.  The data used are removed from the buffer.
+        """
+        
+        found = []
+        buf = self.buffer
+        pos = 0
+        while True:
+            start = buf.find(b'$', pos)
+            if start < 0:
+                # Nothing that looks like a sentence - throw it all away
+                pos = len(buf)
+                break
+                
+            end = buf.find(b'\n', start)
+            if end < 0:
+                if len(buf) - start > _MAX_FRAME_SIZE:
+                    # This one is never going to finish
+                    pos = start + 1
+                    continue
+                # Wait for more data
+                pos = start
+                break
+                
+            restart = buf.find(b'$', start+1, end)
+            if restart >= 0:
+                # Truncated sentence - resynchronize on the next one
+                pos = restart
+                continue
+                
+            found.append(bytes(buf[start:end+1]))
+            pos = end + 1
+            
+        del buf[:pos]
+        return found
+        
+    def read(self):
+        """
+        Read from the port and return a list of (field, status, valid) tuples
+        for the complete sentences received.  The list is empty if the port
+        timed out.
+        """
+        
+        self._fill()
+        return [parseField(frame) for frame in self.frames()]
+        
+    def __iter__(self):
+        while True:
+            for entry in self.read():
+                yield entry
@@ -0,0 +1,464 @@
+"""
+Module for sending and decoding the lightning data feed that spinningCan.py
+sends out via UDP multi-cast.
+
+The feed comes in two flavors:
+  * text - human readable messages of the form "[<date>] <TYPE>: <data> #<seq>"
+  * binary - versioned packets of a fixed header (magic, version, message
+    type, sequence number, float64 UNIX epoch, and payload size) followed by
+    a payload of float64 values
+
+Both decode to the same Message so that consumers can switch between them
+freely.  Each feed numbers its messages independently and SequenceTracker
+can be used on the receiving end to count lost, duplicated, and reordered
+messages.  The binary feed can also carry the raw electric field samples at
+the full 20 Hz rate as SAMPLES packets.  These are batched so that there is
+about one packet per second and are not sent on the text feed.
+"""
+
+import re
+import numpy
+import struct
+import socket
+from collections import namedtuple
+from datetime import datetime, timezone
+
+__version__ = "0.1"
+__all__ = ['DATE_FORMAT', 'MESSAGE_TYPES', 'HIGH_FIELD', 'VERY_HIGH_FIELD', 'FIELD_CLEARED',
+           'LIGHTNING_CLEARED', 'REPLAY_BEGIN', 'REPLAY_END', 'MAX_SAMPLES_PER_PACKET', 'Message',
+           'formatText', 'formatMessage', 'decodeText', 'encodePacket', 'decodePacket', 'decode',
+           'unpackSamples', 'dataServer', 'SequenceTracker', 'dataPublisher',]
+
+
+# Date formating string
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+# Message regular expression
+dataRE = re.compile(r'^\[(?P<date>.*)\] (?P<type>[A-Z]*): (?P<data>.*?)( #(?P<seq>\d+))?$')
+
+# Message types and their codes in binary packets
+MESSAGE_TYPES = {'FIELD':     1,
+                 'DELTA':     2,
+                 'WARNING':   3,
+                 'NOTICE':    4,
+                 'LIGHTNING': 5,
+                 'NODATA':    6,
+                 'SAMPLES':   7,
+                 'REPLAY':    8}
+_MESSAGE_NAMES = {code: name for name,code in MESSAGE_TYPES.items()}
+
+# WARNING message levels
+HIGH_FIELD = 1
+VERY_HIGH_FIELD = 2
+_WARNING_TEXT = {HIGH_FIELD: 'high field',
+                 VERY_HIGH_FIELD: 'very high field'}
+
+# NOTICE message codes
+FIELD_CLEARED = 1
+LIGHTNING_CLEARED = 2
+_NOTICE_TEXT = {FIELD_CLEARED: 'High field cleared',
+                LIGHTNING_CLEARED: 'lightning cleared'}
+
+# REPLAY message markers for the start and end of a block of old messages
+REPLAY_BEGIN = 1
+REPLAY_END = 2
+_REPLAY_TEXT = {REPLAY_BEGIN: 'begin',
+                REPLAY_END: 'end'}
+
+# Binary packet header - magic, version, message type, sequence number, time,
+# and number of payload values
+_PACKET_MAGIC = b'LD'
+_PACKET_VERSION = 1
+_PACKET_HEADER = struct.Struct('!2sBBIdH')
+
+# Largest number of samples in a SAMPLES packet.  The receivers read packets
+# into 1024 byte buffers and a SAMPLES packet carries the sample period as
+# well as the samples.
+MAX_SAMPLES_PER_PACKET = (1024 - _PACKET_HEADER.size) // 8 - 1
+
+# Sequence numbers are 32-bit and wrap
+_SEQ_MASK = 0xFFFFFFFF
+
+# A decoded message.  `time` is a UNIX epoch, `values` is a tuple of floats,
+# and `seq` is None for messages that do not carry a sequence number.
+Message = namedtuple('Message', ['type', 'seq', 'time', 'values'])
+
+
+def _toDatetime(t):
+    """
+    Convert a UNIX epoch into a naive datetime in UTC.  datetime instances are
+    passed through.
+    """
+    
+    try:
+        return datetime.utcfromtimestamp(t)
+    except TypeError:
+        return t
+
+
+def _toEpoch(t):
+    """
+    Convert a datetime instance (naive values are assumed to be in UTC) into
+    a UNIX epoch.  Numbers are passed through.
+    """
+    
+    try:
+        return t.replace(tzinfo=t.tzinfo or timezone.utc).timestamp()
+    except AttributeError:
+        return float(t)
+
+
+def formatText(msgType, t, values=(), seq=None):
+    """
+    Format a message of the given type, time (datetime or UNIX epoch) and
+    values as a text feed message.  If a sequence number is given it is
+    appended to the message.
+    """
+    
+    date = _toDatetime(t).strftime(DATE_FORMAT)
+    if msgType in ('FIELD', 'DELTA'):
+        data = "%+.3f kV/m" % values[0]
+    elif msgType == 'WARNING':
+        data = _WARNING_TEXT[int(values[0])]
+    elif msgType == 'NOTICE':
+        data = _NOTICE_TEXT[int(values[0])]
+    elif msgType == 'LIGHTNING':
+        data = "%.1f km" % values[0]
+    elif msgType == 'NODATA':
+        data = "No data received after %.1f s" % values[0]
+    elif msgType == 'SAMPLES':
+        data = "%i samples every %.3f s" % (len(values)-1, values[0])
+    elif msgType == 'REPLAY':
+        data = _REPLAY_TEXT[int(values[0])]
+    else:
+        data = ' '.join(["%g" % v for v in values])
+    text = "[%s] %s: %s" % (date, msgType, data)
+    if seq is not None:
+        text += " #%i" % seq
+    return text
+
+
+def formatMessage(msg):
+    """
+    Format a Message as a text feed message.  The sequence number is not
+    included.
+    """
+    
+    return formatText(msg.type, msg.time, msg.values)
+
+
+def decodeText(data):
+    """
+    Decode a text feed message and return it as a Message.  Raises a
+    ValueError if the message cannot be decoded.
+    """
+    
+    try:
+        data = data.decode('ascii')
+    except AttributeError:
+        pass
+        
+    mtch = dataRE.match(data)
+    if mtch is None:
+        raise ValueError("Cannot decode '%s'" % data)
+    t = _toEpoch(datetime.strptime(mtch.group('date'), DATE_FORMAT))
+    msgType = mtch.group('type')
+    data = mtch.group('data')
+    seq = mtch.group('seq')
+    if seq is not None:
+        seq = int(seq)
+    
+    if msgType == 'WARNING':
+        values = (VERY_HIGH_FIELD if data.startswith('very') else HIGH_FIELD,)
+    elif msgType == 'NOTICE':
+        values = (LIGHTNING_CLEARED if data.startswith('lightning') else FIELD_CLEARED,)
+    elif msgType == 'NODATA':
+        values = (float(data.split()[-2]),)
+    elif msgType == 'REPLAY':
+        values = (REPLAY_BEGIN if data.startswith('begin') else REPLAY_END,)
+    else:
+        try:
+            values = (float(data.split(None, 1)[0]),)
+        except (IndexError, ValueError):
+            values = ()
+    return Message(msgType, seq, t, values)
+
+
+def encodePacket(msgType, seq, t, values=()):
+    """
+    Encode a message of the given type, sequence number, time (datetime or
+    UNIX epoch) and values as a binary feed packet.
+    """
+    
+    header = _PACKET_HEADER.pack(_PACKET_MAGIC, _PACKET_VERSION, MESSAGE_TYPES[msgType],
+                                 seq & _SEQ_MASK, _toEpoch(t), len(values))
+    return header + struct.pack('!%id' % len(values), *values)
+
+
+def decodePacket(data):
+    """
+    Decode a binary feed packet and return it as a Message.  Raises a
+    ValueError if the packet cannot be decoded.
+    """
+    
+    try:
+        magic, version, code, seq, t, nValue = _PACKET_HEADER.unpack_from(data)
+    except struct.error:
+        raise ValueError("Packet is too short")
+    if magic != _PACKET_MAGIC:
+        raise ValueError("Not a binary feed packet")
+    if version != _PACKET_VERSION:
+        raise ValueError("Unsupported binary feed packet version %i" % version)
+    try:
+        values = struct.unpack_from('!%id' % nValue, data, _PACKET_HEADER.size)
+    except struct.error:
+        raise ValueError("Packet payload is truncated")
+        
+    # REPLAY markers are added by spinningCanBroadcast.py and are not part of
+    # the sender's sequence
+    if code == MESSAGE_TYPES['REPLAY']:
+        seq = None
+    return Message(_MESSAGE_NAMES.get(code, 'UNKNOWN'), seq, t, values)
+
+
+def decode(data):
+    """
+    Decode either a text feed message or a binary feed packet and return it
+    as a Message.  Raises a ValueError if the data cannot be decoded.
+    """
+    
+    if data[:len(_PACKET_MAGIC)] == _PACKET_MAGIC:
+        return decodePacket(data)
+    return decodeText(data)
+
+
+def unpackSamples(msg):
+    """
+    Unpack a SAMPLES Message and return a two-element tuple of the UNIX epochs
+    and electric field values in kV/m as numpy arrays.  The payload of these
+    messages is the sample period in seconds followed by the field values,
+    with the message time being that of the first sample.
+    """
+    
+    fields = numpy.array(msg.values[1:])
+    times = msg.time + numpy.arange(fields.size)*msg.values[0]
+    return times, fields
+
+
+class dataServer(object):
+    def __init__(self, mcastAddr="224.168.2.9", mcastPort=7163, sendPort=7164):
+        self.sendPort  = sendPort
+        self.mcastAddr = mcastAddr
+        self.mcastPort = mcastPort
+        
+        self.sock = None
+        self.seq = 0
+        
+    def start(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        #The sender is bound on (0.0.0.0:7164)
+        self.sock.bind(("0.0.0.0", self.sendPort))
+        #Tell the kernel that we want to multicast and that the data is sent
+        #to everyone (255 is the level of multicasting)
+        self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 20)
+        
+    def stop(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+            
+    def send(self, data):
+        try:
+            data = bytes(data, 'ascii')
+        except TypeError:
+            pass
+        if self.sock is not None:
+            self.sock.sendto(data, (self.mcastAddr, self.mcastPort) )
+            
+    def sendText(self, msgType, t, values=()):
+        """
+        Send a text feed message with the next sequence number and return it.
+        """
+        
+        text = formatText(msgType, t, values, seq=self.seq)
+        self.send(text)
+        self.seq = (self.seq + 1) & _SEQ_MASK
+        return text
+        
+    def sendPacket(self, msgType, t, values=()):
+        """
+        Send a binary feed packet with the next sequence number.
+        """
+        
+        self.send(encodePacket(msgType, self.seq, t, values))
+        self.seq = (self.seq + 1) & _SEQ_MASK
+
+
+class SequenceTracker(object):
+    """
+    Class to follow the sequence numbers of the messages received from a feed
+    and count how many were lost, duplicated, or arrived out of order.  A
+    message that shows up after a later one has already been received is
+    counted as reordered rather than lost.  A jump back to zero or of more
+    than `window` behind the newest one received is taken to mean that the
+    sender was restarted, e.g., spinningCan.py was restarted or a replay
+    started publishing on the same group, and the tracker follows the new
+    sequence from there.  Anything else behind the newest one received is
+    counted as a duplicate.
+    """
+    
+    def __init__(self, window=1024):
+        self.window = int(window)
+        self.reset()
+        
+    def reset(self):
+        """
+        Reset all of the counters.
+        """
+        
+        self.received = 0
+        self.lost = 0
+        self.duplicates = 0
+        self.reordered = 0
+        self.restarts = 0
+        
+        self._last = None
+        self._missing = set()
+        
+    def update(self, seq):
+        """
+        Update the counters with the sequence number of a newly received
+        message.  Returns False if the message looks like a duplicate and
+        True otherwise.  This is only for accounting since a sequence number
+        that looks old may also come from a sender that was restarted.
+        Messages without a sequence number (None) are always accepted and
+        are not counted.
+        """
+        
+        if seq is None:
+            return True
+        seq &= _SEQ_MASK
+        
+        if self._last is None:
+            self._last = seq
+            self.received += 1
+            return True
+            
+        ahead = (seq - self._last) & _SEQ_MASK
+        if ahead == 0:
+            self.duplicates += 1
+            return False
+        elif ahead <= _SEQ_MASK // 2:
+            # Newer than anything we have seen so far
+            newest = self._last + ahead
+            for missing in range(max(self._last + 1, newest - self.window), newest):
+                self._missing.add(missing & _SEQ_MASK)
+            self.lost += ahead - 1
+            self._last = seq
+            if self._missing:
+                self._missing = set(m for m in self._missing if (seq - m) & _SEQ_MASK <= self.window)
+        elif seq in self._missing:
+            # Late but still wanted
+            self._missing.discard(seq)
+            self.lost -= 1
+            self.reordered += 1
+        elif seq == 0 or (self._last - seq) & _SEQ_MASK > self.window:
+            # The sender has started over
+            self.restarts += 1
+            self._last = seq
+            self._missing.clear()
+        else:
+            self.duplicates += 1
+            return False
+            
+        self.received += 1
+        return True
+        
+    @property
+    def lossFraction(self):
+        """
+        Fraction of the messages sent that were lost.
+        """
+        
+        try:
+            return self.lost / float(self.received + self.lost)
+        except ZeroDivisionError:
+            return 0.0
+            
+    def counters(self):
+        """
+        Return a dictionary of the current counter values.
+        """
+        
+        return {'received': self.received, 'lost': self.lost, 'duplicates': self.duplicates,
+                'reordered': self.reordered, 'restarts': self.restarts}
+                
+    def __str__(self):
+        return "%i received, %i lost (%.2f%%), %i duplicated, %i reordered, %i restarts" \
+               % (self.received, self.lost, 100*self.lossFraction, self.duplicates, self.reordered, self.restarts)
+
+
+class dataPublisher(object):
+    """
+    Class to send messages out on the text feed and, optionally, the binary
+    feed.  The configuration dictionary is the same one used by spinningCan.py
+    with the binary feed being enabled through the 'binary_multicast'
+    section.
+    """
+    
+    def __init__(self, config):
+        self.server = dataServer(mcastAddr=config['multicast']['ip'], mcastPort=int(config['multicast']['port']),
+                                 sendPort=int(config['multicast']['port'])+1)
+        
+        self.binaryServer = None
+        binary = config.get('binary_multicast', {})
+        if binary.get('enabled', False):
+            self.binaryServer = dataServer(mcastAddr=binary['ip'], mcastPort=int(binary['port']),
+                                           sendPort=int(binary['port'])+1)
+            
+        # Full rate sample streaming
+        self.streamSamples = self.binaryServer is not None and binary.get('stream_samples', False)
+        self.samplesPerPacket = min(max(int(binary.get('samples_per_packet', 20)), 2), MAX_SAMPLES_PER_PACKET)
+        self._sampleTimes = []
+        self._sampleFields = []
+        
+    def start(self):
+        self.server.start()
+        if self.binaryServer is not None:
+            self.binaryServer.start()
+            
+    def stop(self):
+        self.server.stop()
+        if self.binaryServer is not None:
+            self.binaryServer.stop()
+            
+    def publish(self, msgType, t, values=()):
+        """
+        Send out a message of the given type, time (datetime or UNIX epoch), and
+        values on all of the feeds and return the text version of it without
+        the sequence number.
+        """
+        
+        self.server.sendText(msgType, t, values)
+        if self.binaryServer is not None:
+            self.binaryServer.sendPacket(msgType, t, values)
+        return formatText(msgType, t, values)
+        
+    def addSample(self, t, field):
+        """
+        Add a raw electric field sample at the given time (datetime or UNIX 
+        epoch) to the sample stream.  Once enough samples have been collected
+        they are sent out as a SAMPLES packet on the binary feed.  This does
+        nothing if sample streaming is not enabled.
+        """
+        
+        if not self.streamSamples:
+            return
+            
+        self._sampleTimes.append(_toEpoch(t))
+        self._sampleFields.append(field)
+        if len(self._sampleFields) >= self.samplesPerPacket:
+            period = (self._sampleTimes[-1] - self._sampleTimes[0]) / (len(self._sampleTimes) - 1)
+            self.binaryServer.sendPacket('SAMPLES', self._sampleTimes[0], [period,] + self._sampleFields)
+            self._sampleTimes = []
+            self._sampleFields = []
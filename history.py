@@ -0,0 +1,203 @@
+"""
+Module for keeping the history of time stamped values for the plots in the
+spinningCan.py GUIs.
+
+The history is kept at several resolutions at once, e.g., 1 s, 10 s, 1 min,
+and 10 min, with the minimum, maximum, and mean of the values in each time
+bin.  Each resolution is a fixed size numpy ring buffer that is updated in
+place as values come in so that the memory used, and the number of points
+to draw for any span of time, stays the same no matter how long the GUI
+runs.  The smallest and largest values at each resolution are kept up to
+date as bins come and go so that finding the plot limits does not require
+a pass over the data.
+"""
+
+import numpy
+
+__version__ = "0.3"
+__all__ = ['HistoryLevel', 'FieldHistory',]
+
+
+class HistoryLevel(object):
+    """
+    Class to hold the most recent `size` bins, each `width` seconds wide, of
+    a series of UNIX epoch/value pairs.  The time of each bin is the mean
+    time of the values in it.
+    """
+    
+    def __init__(self, width, size):
+        self.width = float(width)
+        self.size = int(size)
+        self._tsum = numpy.zeros(self.size, dtype=numpy.float64)
+        self._min = numpy.zeros(self.size, dtype=numpy.float64)
+        self._max = numpy.zeros(self.size, dtype=numpy.float64)
+        self._sum = numpy.zeros(self.size, dtype=numpy.float64)
+        self._count = numpy.zeros(self.size, dtype=numpy.float64)
+        
+        self.clear()
+        
+    def clear(self):
+        """
+        Empty the history.
+        """
+        
+        self._head = -1
+        self._n = 0
+        self._bin = None
+        self._lo = numpy.inf
+        self._hi = -numpy.inf
+        
+    def __len__(self):
+        return self._n
+        
+    @property
+    def span(self):
+        """
+        Length of time in seconds covered when the history is full.
+        """
+        
+        return self.width * self.size
+        
+    def append(self, t, value):
+        """
+        Add a new UNIX epoch/value pair, starting a new bin (and dropping the
+        oldest one if the history is full) if it does not fall in the current
+        one.
+        """
+        
+        b = int(t // self.width)
+        if b != self._bin:
+            self._bin = b
+            self._head = (self._head + 1) % self.size
+            full = self._n == self.size
+            self._n = min(self._n + 1, self.size)
+            
+            i = self._head
+            dropped = full and (self._min[i] <= self._lo or self._max[i] >= self._hi)
+            self._tsum[i] = t
+            self._min[i] = value
+            self._max[i] = value
+            self._sum[i] = value
+            self._count[i] = 1
+            
+            if dropped:
+                # The bin that was dropped may have held one of the extrema
+                self._lo = float(self._min.min())
+                self._hi = float(self._max.max())
+                return
+        else:
+            i = self._head
+            self._tsum[i] += t
+            self._min[i] = min(self._min[i], value)
+            self._max[i] = max(self._max[i], value)
+            self._sum[i] += value
+            self._count[i] += 1
+        self._lo = min(self._lo, value)
+        self._hi = max(self._hi, value)
+        
+    def last(self):
+        """
+        Return the time of the newest bin or NaN if the history is empty.
+        """
+        
+        if self._n == 0:
+            return numpy.nan
+        return float(self._tsum[self._head] / self._count[self._head])
+        
+    def min(self):
+        """
+        Return the smallest value in the history or NaN if it is empty.
+        """
+        
+        return self._lo if self._n else numpy.nan
+        
+    def max(self):
+        """
+        Return the largest value in the history or NaN if it is empty.
+        """
+        
+        return self._hi if self._n else numpy.nan
+        
+    def data(self):
+        """
+        Return the times, minimums, maximums, and means of the bins as
+        numpy.float64 arrays, oldest first.
+        """
+        
+        if self._n < self.size:
+            count = self._count[:self._n]
+            return (self._tsum[:self._n] / count, self._min[:self._n].copy(),
+                    self._max[:self._n].copy(), self._sum[:self._n] / count)
+                    
+        shift = -(self._head + 1)
+        count = numpy.roll(self._count, shift)
+        return (numpy.roll(self._tsum, shift) / count, numpy.roll(self._min, shift),
+                numpy.roll(self._max, shift), numpy.roll(self._sum, shift) / count)
+                
+    def counts(self):
+        """
+        Return the number of values in each bin as a numpy.float64 array,
+        oldest first.
+        """
+        
+        if self._n < self.size:
+            return self._count[:self._n].copy()
+        return numpy.roll(self._count, -(self._head + 1))
+
+
+class FieldHistory(object):
+    """
+    Class to hold the history of a series of UNIX epoch/value pairs at
+    several resolutions.  `widths` are the bin widths in seconds, finest
+    first, and each resolution keeps `size` bins.
+    """
+    
+    def __init__(self, widths=(1, 10, 60, 600), size=360):
+        self.levels = [HistoryLevel(width, size) for width in sorted(widths)]
+        self._last = numpy.nan
+        
+    def clear(self):
+        """
+        Empty the history.
+        """
+        
+        for level in self.levels:
+            level.clear()
+        self._last = numpy.nan
+            
+    def __len__(self):
+        return len(self.levels[0])
+        
+    @property
+    def span(self):
+        """
+        Longest length of time in seconds that the history covers.
+        """
+        
+        return self.levels[-1].span
+        
+    def append(self, t, value):
+        """
+        Add a new UNIX epoch/value pair to all of the resolutions.
+        """
+        
+        for level in self.levels:
+            level.append(t, value)
+        self._last = float(t)
+        
+    def last(self):
+        """
+        Return the time of the newest value or NaN if the history is empty.
+        """
+        
+        return self._last
+        
+    def level(self, span):
+        """
+        Return the finest resolution HistoryLevel that covers `span` seconds.
+        """
+        
+        for level in self.levels:
+            if level.span >= span:
+                return level
+        return self.levels[-1]
@@ -0,0 +1,354 @@
+"""
+Module for writing and reading recordings of the raw electric field values
+made by spinningCan.py.
+
+Two formats are supported:
+  * text - one line per valid sample of the form "<date>  <field> kV/m"
+  * binary - a 16 byte header followed by fixed width, 13 byte records of
+    a little endian float64 UNIX epoch, a float32 field in kV/m, and a
+    uint8 of flags (the EFM-100 status code in the lower seven bits and
+    whether or not the sample is valid in the top bit)
+
+Binary recordings can be read back with numpy.memmap without copying and
+text recordings are parsed in bulk into numpy arrays.
+"""
+
+import os
+import gzip
+import struct
+import numpy
+from datetime import datetime, timezone
+
+__version__ = "0.1"
+__all__ = ['DATE_FORMAT', 'BINARY_MAGIC', 'BINARY_VERSION', 'RECORD_DTYPE', 'HEADER_SIZE',
+           'TextRecordWriter', 'BinaryRecordWriter', 'openRecording', 'isBinaryRecording',
+           'readBinaryRecording', 'recordStatus', 'recordValid', 'parseTextLine',
+           'readTextRecording', 'readRecording',]
+
+
+# Date formating string for text recordings
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+# Binary recording header - magic, version, record size, and padding
+BINARY_MAGIC = b'EFM100RC'
+BINARY_VERSION = 1
+_HEADER = struct.Struct('<8sHH4x')
+HEADER_SIZE = _HEADER.size
+
+# Binary recording record layout
+RECORD_DTYPE = numpy.dtype([('time', '<f8'), ('field', '<f4'), ('flags', 'u1')])
+
+# Flag masks
+_STATUS_MASK = 0x7F
+_VALID_FLAG = 0x80
+
+# Text recording line layout, e.g., "2026-07-21 14:02:03.123456   +1.234 kV/m",
+# with 'd' marking digits, '?' marking sign/space/digit positions, and 
+# everything else being fixed.
+_LINE_SIZE = 40
+_LINE_LAYOUT = numpy.frombuffer(b'dddd-dd-dd dd:dd:dd.dddddd  ??d.ddd kV/m', dtype=numpy.uint8)
+_LINE_DIGITS = _LINE_LAYOUT == ord('d')
+_LINE_FIXED = (_LINE_LAYOUT != ord('d')) & (_LINE_LAYOUT != ord('?'))
+_LINE_FIELD = slice(28, 35)
+
+# Chunk size in bytes for reading text recordings
+_CHUNK_SIZE = 4*1024*1024
+
+
+class TextRecordWriter(object):
+    """
+    Class to write the raw electric field values to a text recording.  Only
+    valid values are recorded.
+    """
+    
+    def __init__(self, filename):
+        # `filename` can also be an already open file handle, e.g., sys.stderr
+        if hasattr(filename, 'write'):
+            self.fh = filename
+        else:
+            self.fh = open(filename, 'a+')
+            
+    def write(self, t, field, status=0, valid=True):
+        """
+        Write a datetime instance/electric field value (in kV/m) pair to the
+        recording.
+        """
+        
+        if valid:
+            self.fh.write("%s  %+7.3f kV/m\n" % (t.strftime(DATE_FORMAT), field))
+            self.fh.flush()
+            
+    def close(self):
+        self.fh.close()
+
+
+class BinaryRecordWriter(object):
+    """
+    Class to write the raw electric field values to a binary recording.  All
+    values are recorded, with validity stored in the record flags.
+    
+    Each record is written with a single unbuffered write so that the file
+    always ends on a record boundary.  If the file is truncated out from
+    under us (as with logrotate's copytruncate) a new header is written
+    before the next record.
+    """
+    
+    def __init__(self, filename):
+        self.fh = open(filename, 'ab', buffering=0)
+        self._record = numpy.zeros(1, dtype=RECORD_DTYPE)
+        
+    def write(self, t, field, status=0, valid=True):
+        """
+        Write a datetime instance (naive values are assumed to be in UTC)/
+        electric field value (in kV/m) pair, along with the EFM-100 status code
+        and validity, to the recording.
+        """
+        
+        if os.fstat(self.fh.fileno()).st_size == 0:
+            self.fh.write(_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, RECORD_DTYPE.itemsize))
+            
+        try:
+            t = t.replace(tzinfo=t.tzinfo or timezone.utc).timestamp()
+        except AttributeError:
+            pass
+        self._record['time'] = t
+        self._record['field'] = field
+        self._record['flags'] = (int(status) & _STATUS_MASK) | (_VALID_FLAG if valid else 0)
+        self.fh.write(self._record.tobytes())
+        
+    def close(self):
+        self.fh.close()
+
+
+def openRecording(filename):
+    """
+    Open a recording for reading in binary mode, transparently dealing with
+    gzip compressed files.
+    """
+    
+    with open(filename, 'rb') as fh:
+        magic = fh.read(2)
+    if magic == b'\x1f\x8b':
+        return gzip.open(filename, 'rb')
+    return open(filename, 'rb')
+
+
+def isBinaryRecording(filename):
+    """
+    Determine whether or not the specified file (which may be gzip
+    compressed) is a binary recording.
+    """
+    
+    with openRecording(filename) as fh:
+        header = fh.read(HEADER_SIZE)
+    return header[:len(BINARY_MAGIC)] == BINARY_MAGIC
+
+
+def readBinaryRecording(filename):
+    """
+    Read in a binary recording and return a numpy record array with 'time',
+    'field', and 'flags' fields.  For uncompressed files this is a read-only
+    numpy.memmap of the file so no data are copied.  Any partial record at
+    the end of the file is ignored.
+    
+    The status codes and validity can be extracted from the flags with
+    recordStatus() and recordValid().
+    """
+    
+    with openRecording(filename) as fh:
+        header = fh.read(HEADER_SIZE)
+        try:
+            magic, version, size = _HEADER.unpack(header)
+        except struct.error:
+            magic, version, size = None, None, None
+        if magic != BINARY_MAGIC:
+            raise RuntimeError("'%s' is not a binary recording" % filename)
+        if version != BINARY_VERSION or size != RECORD_DTYPE.itemsize:
+            raise RuntimeError("Unsupported binary recording version %s with %s B records" % (version, size))
+            
+        if isinstance(fh, gzip.GzipFile):
+            data = fh.read()
+            nRecord = len(data) // RECORD_DTYPE.itemsize
+            return numpy.frombuffer(data, dtype=RECORD_DTYPE, count=nRecord)
+            
+    nRecord = (os.path.getsize(filename) - HEADER_SIZE) // RECORD_DTYPE.itemsize
+    if nRecord <= 0:
+        return numpy.zeros(0, dtype=RECORD_DTYPE)
+    return numpy.memmap(filename, dtype=RECORD_DTYPE, mode='r', offset=HEADER_SIZE, shape=(nRecord,))
+
+
+def recordStatus(records):
+    """
+    Return the EFM-100 status codes for an array of binary records.
+    """
+    
+    return records['flags'] & _STATUS_MASK
+
+
+def recordValid(records):
+    """
+    Return whether or not each of an array of binary records is valid.
+    """
+    
+    return (records['flags'] & _VALID_FLAG) != 0
+
+
+def _daysFromCivil(year, month, day):
+    """
+    Vectorized conversion of a proleptic Gregorian calendar date into the
+    number of days since 1970-01-01.
+    """
+    
+    year = year - (month <= 2)
+    era = year // 400
+    yoe = year - era*400
+    doy = (153*(month + numpy.where(month > 2, -3, 9)) + 2)//5 + day - 1
+    doe = yoe*365 + yoe//4 - yoe//100 + doy
+    return era*146097 + doe - 719468
+
+
+def parseTextLine(line):
+    """
+    Parse a single line from a text recording the slow way, returning a two-
+    element tuple of the UNIX epoch and the field in kV/m, or None if the line
+    cannot be parsed.
+    """
+    
+    try:
+        line = line.decode('ascii', errors='ignore').replace('\x00', '')
+        t, f = line.split('  ', 1)
+        t = datetime.strptime(t.strip(), DATE_FORMAT).replace(tzinfo=timezone.utc)
+        f, junk = f.split(None, 1)
+        return t.timestamp(), float(f)
+    except ValueError:
+        return None
+
+
+def _parseTextChunk(chunk):
+    """
+    Parse a bytes object containing complete lines from a text recording and
+    return a two-element tuple of UNIX epochs and fields in kV/m as numpy
+    arrays.  Lines are parsed in bulk where they follow the fixed width layout
+    written by TextRecordWriter and one at a time otherwise.  Lines that
+    cannot be parsed at all, like the partial lines left behind by
+    logrotate's copytruncate, are skipped.
+    """
+    
+    data = numpy.frombuffer(chunk, dtype=numpy.uint8)
+    ends = numpy.where(data == ord('\n'))[0]
+    starts = numpy.empty_like(ends)
+    starts[0:1] = 0
+    starts[1:] = ends[:-1] + 1
+    
+    # Pull out the lines that have the right size and layout
+    good = (ends - starts) == _LINE_SIZE
+    lines = data[starts[good][:,None] + numpy.arange(_LINE_SIZE)]
+    digits = lines[:,_LINE_DIGITS] - ord('0')
+    valid = (digits <= 9).all(axis=1)
+    valid &= (lines[:,_LINE_FIXED] == _LINE_LAYOUT[_LINE_FIXED]).all(axis=1)
+    good[good] = valid
+    lines, digits = lines[valid], digits[valid].astype(numpy.int64)
+    
+    # Convert the time stamps to UNIX epochs via integer microseconds to get
+    # the same values as datetime.timestamp()
+    def value(first, last):
+        v = numpy.zeros(len(digits), dtype=numpy.int64)
+        for i in range(first, last):
+            v = v*10 + digits[:,i]
+        return v
+    days = _daysFromCivil(value(0, 4), value(4, 6), value(6, 8))
+    secs = days*86400 + value(8, 10)*3600 + value(10, 12)*60 + value(12, 14)
+    times = (secs*1000000 + value(14, 20)) / 1e6
+    
+    field = numpy.ascontiguousarray(lines[:,_LINE_FIELD]).view('S%i' % (_LINE_FIELD.stop-_LINE_FIELD.start))
+    field = field.ravel()
+    try:
+        fields = field.astype(numpy.float64)
+    except ValueError:
+        # Something like "-+1.234" slipped through - find out what
+        fields = numpy.zeros(len(field))
+        for i,f in enumerate(field):
+            try:
+                fields[i] = float(f)
+            except ValueError:
+                fields[i] = numpy.nan
+        valid = numpy.isfinite(fields)
+        good[good] = valid
+        times, fields = times[valid], fields[valid]
+        
+    # Deal with anything else one line at a time
+    bad = numpy.where(~good)[0]
+    if len(bad):
+        extra = [parseTextLine(chunk[starts[i]:ends[i]]) for i in bad]
+        keep = numpy.array([e is not None for e in extra])
+        if any(keep):
+            order = numpy.concatenate([numpy.where(good)[0], bad[keep]])
+            times = numpy.concatenate([times, [e[0] for e in extra if e is not None]])
+            fields = numpy.concatenate([fields, [e[1] for e in extra if e is not None]])
+            order = numpy.argsort(order, kind='stable')
+            times, fields = times[order], fields[order]
+            
+    return times, fields
+
+
+def readTextRecording(filename, chunkSize=_CHUNK_SIZE, offset=0, size=None):
+    """
+    Read in a text recording (which may be gzip compressed) in large chunks
+    and return a two-element tuple of the UNIX epochs and electric field 
+    values in kV/m as numpy.float64 arrays.  Lines that cannot be parsed are
+    skipped.
+    
+    The `offset` and `size` keywords can be used to only read `size` bytes 
+    (or the rest of the file if `size` is None) starting at byte `offset`
+    of the uncompressed recording.  These should fall on line boundaries.
+    """
+    
+    times, fields = [], []
+    with openRecording(filename) as fh:
+        fh.seek(offset)
+        leftover = b''
+        while True:
+            if size is not None:
+                chunkSize = min(chunkSize, size)
+                size -= chunkSize
+            chunk = fh.read(chunkSize)
+            if not chunk:
+                break
+            chunk = leftover + chunk
+            
+            last = chunk.rfind(b'\n')
+            if last < 0:
+                leftover = chunk
+                continue
+            leftover = chunk[last+1:]
+            
+            t, f = _parseTextChunk(chunk[:last+1])
+            times.append(t)
+            fields.append(f)
+            
+        if leftover:
+            entry = parseTextLine(leftover)
+            if entry is not None:
+                times.append(numpy.array([entry[0],]))
+                fields.append(numpy.array([entry[1],]))
+                
+    if len(times) == 0:
+        return numpy.zeros(0), numpy.zeros(0)
+    return numpy.concatenate(times), numpy.concatenate(fields)
+
+
+def readRecording(filename):
+    """
+    Read in either a text or a binary recording (which may be gzip compressed)
+    and return a two-element tuple of the UNIX epochs and electric field
+    values in kV/m as numpy arrays.  Only valid samples are returned.
+    """
+    
+    if isBinaryRecording(filename):
+        records = readBinaryRecording(filename)
+        valid = recordValid(records)
+        if valid.all():
+            return records['time'], records['field']
+        return records['time'][valid], records['field'][valid]
+    else:
+        return readTextRecording(filename)
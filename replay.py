@@ -0,0 +1,102 @@
+"""
+Module for pacing the replay of recorded electric field data so that it is
+sent out at the same rate that it was recorded at, or at some multiple of
+that rate.
+
+Each sample is scheduled against a monotonic clock relative to the first
+sample, rather than by sleeping for the time between samples, so that any
+time spent processing the samples does not accumulate into a drift.
+"""
+
+import time
+
+__version__ = "0.1"
+__all__ = ['ReplayPacer',]
+
+
+class ReplayPacer(object):
+    """
+    Class to hold the replay of time stamped samples to a particular speed.
+    `speed` is how many times faster than real time the replay should run,
+    with zero meaning as fast as possible.  Gaps in the recorded time stamps
+    longer than `maxGap` seconds, if given, are skipped over instead of waited
+    out.
+    
+    `clock` and `sleep` default to time.monotonic and time.sleep and can be
+    replaced for testing.
+    """
+    
+    def __init__(self, speed=1.0, maxGap=None, clock=time.monotonic, sleep=time.sleep):
+        self.speed = float(speed)
+        self.maxGap = None if maxGap is None else float(maxGap)
+        self.clock = clock
+        self.sleep = sleep
+        
+        self.reset()
+        
+    def reset(self):
+        """
+        Forget the current schedule and statistics.
+        """
+        
+        self._t0 = None
+        self._c0 = None
+        self._tLast = None
+        
+        self.count = 0
+        self.maxLag = 0.0
+        self.tStart = None
+        
+    def wait(self, t):
+        """
+        Wait until it is time to send the sample recorded at UNIX epoch `t`.
+        Returns how late, in seconds of wall time, the sample is.
+        """
+        
+        now = self.clock()
+        if self.tStart is None:
+            self.tStart = now
+        self.count += 1
+        
+        if self.speed <= 0:
+            return 0.0
+            
+        if self._t0 is None or t < self._tLast \
+           or (self.maxGap is not None and t - self._tLast > self.maxGap):
+            # Start a new schedule at the first sample and after any gaps
+            self._t0, self._c0 = t, now
+        self._tLast = t
+        
+        delay = self._c0 + (t - self._t0) / self.speed - now
+        if delay > 0:
+            self.sleep(delay)
+            return 0.0
+            
+        self.maxLag = max(self.maxLag, -delay)
+        return -delay
+        
+    def iterate(self, times):
+        """
+        Iterate over an array of UNIX epochs and yield the index of each one
+        when it is time to send it.
+        """
+        
+        for i,t in enumerate(times):
+            self.wait(t)
+            yield i
+            
+    @property
+    def elapsed(self):
+        """
+        Wall time in seconds since the first sample.
+        """
+        
+        if self.tStart is None:
+            return 0.0
+        return self.clock() - self.tStart
+        
+    def __str__(self):
+        elapsed = self.elapsed
+        rate = self.count / elapsed if elapsed > 0 else 0.0
+        return "%i samples in %.1f s (%.1f samples/s), max. lag %.1f ms" % (self.count, elapsed, rate,
+                                                                           self.maxLag*1000)
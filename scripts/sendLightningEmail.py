@@ -20,12 +20,12 @@ from socket import gethostname
 import smtplib
 from email.mime.text import MIMEText
 
-import re
 from datetime import datetime, timedelta
 
 from lwa_auth import STORE as LWA_AUTH_STORE
 
-dataRE = re.compile(r'^\[(?P<date>.*)\] (?P<type>[A-Z]*): (?P<data>.*)$')
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from feed import decode, SequenceTracker
 
 # Site
 SITE = gethostname().split('-', 1)[0]
@@ -139,25 +139,24 @@ def EFM100(mcastAddr="224.168.2.9", mcastPort=7163, distance_limit=15.0, rate_li
     # Setup lightning control variable
     isClose = False
     
+    # Message loss accounting
+    tracker = SequenceTracker()
+    
     # Main reading loop
     try:
         while True:
             try:
                 data, addr = sock.recvfrom(1024)
                 
-                # RegEx matching for message date, type, and content
-                try:
-                    data = data.decode('ascii')
-                except AttributeError:
-                    pass
-                mtch = dataRE.match(data)
-                t = datetime.strptime(mtch.group('date'), "%Y-%m-%d %H:%M:%S.%f")
+                # Decode the message date, type, and content
+                msg = decode(data)
+                tracker.update(msg.seq)
+                t = datetime.utcfromtimestamp(msg.time)
                 
                 # If we have a lightning strike, figure out it if is close
                 # enough to warrant saving the strike info.
-                if mtch.group('type') == 'LIGHTNING':
-                    dist, junk = mtch.group('data').split(None, 1)
-                    dist = float(dist)
+                if msg.type == 'LIGHTNING':
+                    dist = msg.values[0]
                     
                     if dist <= distance_limit:
                         strikes[t] = dist
@@ -194,10 +193,13 @@ def EFM100(mcastAddr="224.168.2.9", mcastPort=7163, distance_limit=15.0, rate_li
                         
             except socket.error as e:
                 pass
+            except ValueError as e:
+                pass
                 
     except KeyboardInterrupt:
         sock.close()
         print('')
+        print("Messages: %s" % tracker)
 
 
 if __name__ == "__main__":
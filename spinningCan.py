@@ -6,123 +6,20 @@ atmospheric electric field monitor and printing out the electric field and it ch
 """
 
 import os
-import re
 import sys
 import json
 import numpy
 import serial
-import socket
 import argparse
 import threading
 import json_minify
-from datetime import datetime, timedelta
+from datetime import datetime
 
 from efield import ElectricField
-
-# Electric field string regular expression
-fieldRE = re.compile('\$(?P<field>[-+]\d{2}\.\d{2}),(?P<status>\d)\*(?P<checksum>[0-9A-F]{2})')
-
-# Date formating string
-dateFmt = "%Y-%m-%d %H:%M:%S.%f"
-
-
-def computeChecksum(text):
-    """
-    Compute the checksum for the output string using the first 10 characters.
-    Return the checksum as a string for easy comparision in parseField.
-    """
-    
-    cSum = 0
-    for c in text[:10]:
-        cSum += ord(c)
-        cSum %= 256
-        
-    return "%2X" % cSum
-
-
-def parseField(text):
-    """
-    Parse the output string with the format:
-      $<p><ee.ee>,<f>*<cs><cr><lf>
-      
-      <p> - polarity of electric field + or -
-      <ee.ee> - electric field level 00.00 to 20.00
-      <f> - fault 0: Normal, 1: Rotor Fault
-      <cs> - checksum in hex 00 to FF
-      <cr> - carriage return
-      <lf> - line feed
-      
-    And return a three-element tuple of the field string, status code, and 
-    a boolean of whether or not the data are valid.
-    """
-
-    mtch = fieldRE.match(text)
-
-    try:
-        field = float(mtch.group('field'))
-        status = int(mtch.group('status'))
-        valid = True if mtch.group('checksum') == computeChecksum(text) else False
-    except:
-        field = 0.0
-        status = 2
-        valid = False
-        
-    return field, status, valid
-
-
-class dataServer(object):
-    def __init__(self, mcastAddr="224.168.2.9", mcastPort=7163, sendPort=7164):
-        self.sendPort  = sendPort
-        self.mcastAddr = mcastAddr
-        self.mcastPort = mcastPort
-        
-        self.sock = None
-        
-    def start(self):
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
-        #The sender is bound on (0.0.0.0:7164)
-        self.sock.bind(("0.0.0.0", self.sendPort))
-        #Tell the kernel that we want to multicast and that the data is sent
-        #to everyone (255 is the level of multicasting)
-        self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 20)
-        
-    def stop(self):
-        if self.sock is not None:
-            self.sock.close()
-            self.sock = None
-        
-    def send(self, data):
-        try:
-            data = bytes(data, 'ascii')
-        except TypeError:
-            pass
-        if self.sock is not None:
-            self.sock.sendto(data, (self.mcastAddr, self.mcastPort) )
-
-
-def alignDataStream(SerialPort):
-    """
-    Read from the SerialPort one byte at a time until we find a '$' (which marks
-    the start of a EFM-100 data entry).  Return the dollar sign when we find it.
-    """
-    
-    text = SerialPort.read(1)
-    try:
-        text = text.decode('ascii')
-    except AttributeError:
-        pass
-    except UnicodeDecodeError:
-        text = ''
-    while text != '$':
-        text = SerialPort.read(1)
-        try:
-            text = text.decode('ascii')
-        except AttributeError:
-            pass
-        except UnicodeDecodeError:
-            text = ''
-            
-    return text
+from feed import dataPublisher
+from alerts import AlertEngine
+from efm100 import SentenceReader
+from recording import TextRecordWriter, BinaryRecordWriter
 
 
 def main(args):
@@ -151,155 +48,50 @@ def main(args):
     # Setup the recording option.  If we aren't supposed to record, set
     # `rFH` to sys.stderr.
     if args.record_to is not None:
-        rFH = open(args.record_to, 'a+')
+        if args.record_format == 'binary':
+            rFH = BinaryRecordWriter(args.record_to)
+        else:
+            rFH = TextRecordWriter(args.record_to)
     else:
-        rFH = sys.stderr
+        rFH = TextRecordWriter(sys.stderr)
     
     # Set the field
     movingField = ElectricField()
     movingField.updateConfig(args.config_file)
     
-    # Open the port and find the start of the data stream
+    # Open the port and setup the sentence reader
     efm100.open()
-    text = alignDataStream(efm100)
-    try:
-        text = text.decode('ascii')
-    except AttributeError:
-        pass
-    except UnicodeDecodeError:
-        text = ''
-        
+    reader = SentenceReader(efm100)
+    
     # Start the data server
-    server = dataServer(mcastAddr=args.config_file['multicast']['ip'], mcastPort=int(args.config_file['multicast']['port']), 
-                        sendPort=int(args.config_file['multicast']['port'])+1)
+    server = dataPublisher(args.config_file)
     server.start()
-
-    # Set the warning suppression interval
-    fieldHigh = False
-    lightningDetected = False
-    fieldInterval = timedelta(0, int(60*float(args.config_file['efield']['report_interval'])))
-    fieldClearedInterval = timedelta(0, int(60*float(args.config_file['efield']['cleared_interval'])))
-    lightningInterval = timedelta(0, int(60*float(args.config_file['lightning']['report_interval'])))
-    lightningClearedInterval = timedelta(0, int(60*float(args.config_file['lightning']['cleared_interval'])))
     
-    lastFieldEvent = None
-    lastLightningEvent = None
+    # Set the warning suppression intervals
+    alerts = AlertEngine()
+    alerts.updateConfig(args.config_file)
     
     # Read from the serial port forever (or at least until a keyboard interrupt has
     # been sent).
     try:
-        c = 0
-        while True:
-            if text:
-                new_text = efm100.read(13)
-                try:
-                    new_text = new_text.decode('ascii')
-                except AttributeError:
-                    pass
-                text = text + new_text.replace('\x00', '')
-                text = text.replace('\r\n', '\n')
-                
-                # Parse the string and extract the various bits that we are
-                # interested in using parseField and record it if needed
-                t = datetime.utcnow()
-                f, s, v = parseField(text)
-                if v:
-                    rFH.write("%s  %+7.3f kV/m\n" % (t.strftime(dateFmt), f))
-                    rFH.flush()
-                    
-                # Add it to the list
-                movingField.append(t, f)
+        for f, s, v in reader:
+            # Time tag the sentence and record it if needed
+            t = datetime.utcnow()
+            rFH.write(t, f, s, v)
+            
+            # Add it to the list and the sample stream
+            movingField.append(t, f)
+            server.addSample(t, f)
+            
+            # Send out field and change notices, warnings, and lightning reports
+            for event in alerts.update(movingField):
+                text = server.publish(event.type, event.time, event.values)
+                if event.type in ('FIELD', 'DELTA'):
+                    continue
+                print(text)
+                lFH.write("%s\n" % text)
+                lFH.flush()
                 
-                # Send out field and change notices
-                c += 1
-                if c % movingField.nKeep == 0:
-                    server.send("[%s] FIELD: %+.3f kV/m" % (t.strftime(dateFmt), movingField.mean()))
-                    server.send("[%s] DELTA: %+.3f kV/m" % (t.strftime(dateFmt), movingField.deriv()))
-                    
-                    c = 0
-                    
-                # Issue field warnings, if needed
-                fieldText = None
-                if movingField.isVeryHigh():
-                    if lastFieldEvent is None:
-                        fieldText = "[%s] WARNING: very high field" % t.strftime(dateFmt)
-                        lastFieldEvent = t
-                    elif t >= lastFieldEvent + fieldInterval:
-                        fieldText = "[%s] WARNING: very high field" % t.strftime(dateFmt)
-                        lastFieldEvent = t
-                    else:
-                        pass
-                        
-                    fieldHigh = True
-                    
-                elif movingField.isHigh():
-                    if lastFieldEvent is None:
-                        fieldText = "[%s] WARNING: high field" % t.strftime(dateFmt)
-                        lastFieldEvent = t
-                    elif t >= lastFieldEvent + fieldInterval:
-                        fieldText = "[%s] WARNING: high field" % t.strftime(dateFmt)
-                        lastFieldEvent = t
-                    else:
-                        pass
-                        
-                    fieldHigh = True
-                    
-                else:
-                    if lastFieldEvent is None:
-                        pass
-                    elif t >= lastFieldEvent + fieldClearedInterval and fieldHigh:
-                        fieldText = "[%s] NOTICE: High field cleared" % t.strftime(dateFmt)
-                        fieldHigh = False
-                    else:
-                        pass
-                        
-                # Issue lightning warnings, if needed
-                lightningText = None
-                if movingField.isLightning() and movingField.isHigh():
-                    if lastLightningEvent is None:
-                        lightningText = "[%s] LIGHTNING: %.1f km" % (t.strftime(dateFmt), movingField.getLightningDistance())
-                        lastLightningEvent = t
-                    elif t >= lastLightningEvent + lightningInterval:
-                        lightningText = "[%s] LIGHTNING: %.1f km" % (t.strftime(dateFmt), movingField.getLightningDistance())
-                        lastLightningEvent = t
-                        
-                    lightningDetected = True
-                    
-                else:
-                    if lastLightningEvent is None:
-                        pass
-                    elif t >= lastLightningEvent + lightningClearedInterval and lightningDetected:
-                        fieldText = "[%s] NOTICE: lightning cleared" % t.strftime(dateFmt)
-                        lightningDetected = False
-                    else:
-                        pass
-                        
-                # Actually send the message out over UDP
-                if fieldText is not None:
-                    print(fieldText)
-                    server.send(fieldText)
-                    lFH.write("%s\n" % fieldText)
-                    lFH.flush()
-                    
-                if lightningText is not None:
-                    print(lightningText)
-                    server.send(lightningText)
-                    lFH.write("%s\n" % lightningText)
-                    lFH.flush()
-                    
-                # Start the next loop.  If we don't get enough characters (because 
-                # the detector has lost power, for instance).  Run the re-alignment
-                # function again to try to get the stream back.
-                text = efm100.read(1)
-                if len(text) < 1:
-                    text = alignDataStream(efm100)
-                try:
-                    text = text.decode('ascii')
-                except AttributeError:
-                    pass
-                except UnicodeDecodeError:
-                    text = ''
-                    
     except KeyboardInterrupt:
         efm100.close()
         server.stop()
@@ -326,6 +118,8 @@ if __name__ == "__main__":
                         help='file to log operational status to')
     parser.add_argument('-r', '--record-to', type=str,
                         help='record the raw electric field data to a file')
+    parser.add_argument('-f', '--record-format', type=str, choices=['text', 'binary'], default='text',
+                        help='format to use when recording the raw electric field data')
     args = parser.parse_args()
     
     # Parse the configuration file
@@ -1,34 +1,615 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
 """
 Broadcast lightning data served up by spinningCan.py using TCP.
-"""
 
-from __future__ import print_function
+The multicast feed, the TCP listener, and each of the connected clients are
+all handled by asyncio so that a slow subscriber cannot hold up the others
+and new connections are accepted as soon as they arrive.  Every client has
+a bounded queue of messages waiting to be sent.  If a client falls so far
+behind that its queue fills up either the oldest messages are dropped or
+the client is disconnected, depending on the drop policy.
+
+Clients can limit what they receive by sending a subscription request as a
+single line of JSON, e.g.:
+  {"types": ["LIGHTNING", "NOTICE"], "min_interval": 60, "max_distance": 15}
+where "types" is a list of message types to receive, "min_interval" is the
+minimum time in seconds between messages of the same type, and
+"max_distance" is the farthest LIGHTNING message in km to pass on.  All of
+the keys are optional and a new request replaces the previous one.  Clients
+that never send a request receive everything.
+
+The broadcaster also keeps a ring of the most recent messages, limited both
+in number and in age, so that new clients can catch up.  A new client can be
+sent the last few minutes of the ring before the live data either by default
+(--replay-window) or by adding "replay" with the number of seconds wanted
+to a subscription request.  The old messages are bracketed by REPLAY begin
+and end messages so that they can be told apart from the live ones.
+
+Messages are framed on the TCP connection either with a trailing newline
+(text feed only) or with a two byte, big endian length prefix (either
+feed).  Messages that arrive within a short window of each other are sent
+to a client with a single write.
+
+Web dashboards can be served from an optional HTTP port (--http-port) that
+provides:
+  /events - a Server-Sent Events stream of the feed with each message as a
+            JSON object.  The subscription options above can be given as
+            query parameters, e.g., /events?types=LIGHTNING,NOTICE&replay=600
+  /latest - a JSON snapshot of the current field, field change, last strike,
+            and alert state
+Events clients share the same queues and replay ring as the TCP clients.
+"""
 
 import sys
+import json
 import time
-import select
 import socket
+import struct
+import asyncio
 import argparse
-from datetime import datetime
+from itertools import islice
+from collections import deque
+from urllib.parse import urlparse, parse_qs
 
-
-# Date formating string
-dateFmt = "%Y-%m-%d %H:%M:%S.%f"
+from feed import decode, formatText, formatMessage, encodePacket, SequenceTracker, VERY_HIGH_FIELD, \
+                 FIELD_CLEARED, LIGHTNING_CLEARED, REPLAY_BEGIN, REPLAY_END
 
 
 # Multicast timeout in seconds
 timeout = 5
 
+# Default maximum number of messages waiting to be sent to a client
+QUEUE_SIZE = 256
+
+# What to do with a client whose queue is full
+DROP_POLICIES = ('drop-oldest', 'disconnect')
+
+# Ways to frame the messages on the TCP connection
+FRAMINGS = ('newline', 'length')
+
+# Default time in seconds to wait for more messages before writing to a client
+COALESCE = 0.01
+
+# Largest amount of data in bytes to write at once during a replay
+_REPLAY_CHUNK = 64*1024
+
+# Default limits on the number and age in seconds of the messages kept for
+# catching up new clients
+RING_SIZE = 4096
+RING_AGE = 3600.0
+
+
+def frameMessage(data, framing='newline'):
+    """
+    Frame a message for sending over TCP.
+    """
+    
+    if framing == 'length':
+        return struct.pack('!H', len(data)) + data
+    return data.rstrip(b'\r\n') + b'\n'
+
+
+def eventMessage(msg):
+    """
+    Format a decoded Message as a Server-Sent Event.
+    """
+    
+    body = json.dumps({'type': msg.type, 'seq': msg.seq, 'time': msg.time,
+                       'values': list(msg.values), 'text': formatMessage(msg)})
+    event = "event: %s\ndata: %s\n\n" % (msg.type, body)
+    if msg.seq is not None:
+        event = "id: %i\n%s" % (msg.seq, event)
+    return event.encode()
+
+
+def httpResponse(status, body=b'', contentType='text/plain', headers=()):
+    """
+    Build a complete HTTP response.  If `body` is None the response is left
+    open for streaming.
+    """
+    
+    lines = ["HTTP/1.1 %s" % status,
+             "Content-Type: %s" % contentType,
+             "Cache-Control: no-cache",
+             "Access-Control-Allow-Origin: *"]
+    lines.extend(headers)
+    if body is not None:
+        lines.append("Content-Length: %i" % len(body))
+        lines.append("Connection: close")
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode() + (body or b'')
+
+
+class Subscription(object):
+    """
+    Class for the messages that a client has asked to receive.
+    """
+    
+    def __init__(self, types=None, minInterval=0.0, maxDistance=None, replay=None):
+        self.types = None if types is None else set(types)
+        self.minInterval = float(minInterval)
+        self.maxDistance = None if maxDistance is None else float(maxDistance)
+        self.replay = None if replay is None else float(replay)
+        
+        self._last = {}
+        
+    @classmethod
+    def fromRequest(cls, line):
+        """
+        Build a Subscription from a JSON subscription request.  Raises a
+        ValueError if the request is not valid.
+        """
+        
+        try:
+            request = json.loads(line)
+            types = request.get('types', None)
+            if isinstance(types, str):
+                types = [types,]
+            if types is not None:
+                types = [str(t).upper() for t in types]
+            return cls(types=types, minInterval=request.get('min_interval', 0.0),
+                       maxDistance=request.get('max_distance', None),
+                       replay=request.get('replay', None))
+        except (AttributeError, TypeError, ValueError) as e:
+            raise ValueError("Invalid subscription request: %s" % str(e))
+            
+    @classmethod
+    def fromQuery(cls, query):
+        """
+        Build a Subscription from the query string of an HTTP request.  Raises
+        a ValueError if the query is not valid.
+        """
+        
+        request = {}
+        for key,value in parse_qs(query).items():
+            if key == 'types':
+                request[key] = ','.join(value).split(',')
+            else:
+                request[key] = float(value[-1])
+        return cls.fromRequest(json.dumps(request))
+        
+    def accept(self, msg):
+        """
+        Decide whether or not a decoded Message should be sent to the client.
+        Messages that could not be decoded (None) are only sent to clients that
+        have not asked for specific types.
+        """
+        
+        if msg is None:
+            return self.types is None
+        if self.types is not None and msg.type not in self.types:
+            return False
+        if self.maxDistance is not None and msg.type == 'LIGHTNING' and msg.values[0] > self.maxDistance:
+            return False
+        if self.minInterval > 0:
+            last = self._last.get(msg.type, None)
+            if last is not None and 0 <= msg.time - last < self.minInterval:
+                return False
+            self._last[msg.type] = msg.time
+        return True
+
+
+class Client(object):
+    """
+    Class for a connected TCP subscriber that holds the messages waiting to
+    be sent to it.
+    """
+    
+    def __init__(self, writer, queueSize=QUEUE_SIZE, policy='drop-oldest', coalesce=COALESCE, events=False):
+        self.writer = writer
+        self.events = events
+        self.address = writer.get_extra_info('peername')[:2]
+        self.queueSize = int(queueSize)
+        self.policy = policy
+        self.coalesce = float(coalesce)
+        
+        # We do our own batching so there is no need for Nagle
+        sock = writer.get_extra_info('socket')
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        
+        self.queue = deque()
+        self.ready = asyncio.Event()
+        self.dropped = 0
+        self.closed = False
+        self.subscription = Subscription()
+        self.replay = None
+        
+    def put(self, data):
+        """
+        Add a message to the queue.  Returns False if the queue is full and the
+        client should be disconnected, True otherwise.
+        """
+        
+        if len(self.queue) >= self.queueSize:
+            if self.policy == 'disconnect':
+                return False
+            self.queue.popleft()
+            self.dropped += 1
+        self.queue.append(data)
+        self.ready.set()
+        return True
+        
+    def startReplay(self, broadcaster, index, stop, since, begin, end):
+        """
+        Send the messages in the broadcaster's ring from absolute index `index`
+        up to, but not including, `stop` that were received at or after `since`
+        ahead of any live messages, bracketed by the `begin` and `end` markers.
+        Anything already queued is dropped since it is also in the ring.
+        """
+        
+        self.queue.clear()
+        self.replay = (broadcaster, index, stop, since, begin, end)
+        self.ready.set()
+        
+    async def _sendReplay(self):
+        """
+        Send the pending replay.
+        """
+        
+        broadcaster, index, stop, since, begin, end = self.replay
+        self.replay = None
+        
+        chunk, size = [begin,], len(begin)
+        while True:
+            # Messages that have left the ring while we were waiting on the
+            # client are lost
+            index = max(index, broadcaster.ringStart)
+            if index >= stop:
+                break
+                
+            full = False
+            for t,data,msg,event in islice(broadcaster.ring, index - broadcaster.ringStart,
+                                           stop - broadcaster.ringStart):
+                index += 1
+                if self.events:
+                    data = event
+                if t >= since and data is not None and self.subscription.accept(msg):
+                    chunk.append(data)
+                    size += len(data)
+                    if size >= _REPLAY_CHUNK:
+                        full = True
+                        break
+            if not full:
+                break
+                
+            self.writer.write(b''.join(chunk))
+            await self.writer.drain()
+            chunk, size = [], 0
+            if self.closed or self.replay is not None:
+                return
+        chunk.append(end)
+        self.writer.write(b''.join(chunk))
+        
+    def close(self):
+        """
+        Close the connection without waiting on any unsent data.
+        """
+        
+        self.closed = True
+        self.ready.set()
+        self.writer.transport.abort()
+        
+    async def run(self):
+        """
+        Send queued messages to the client until it goes away.
+        """
+        
+        try:
+            while not self.closed:
+                await self.ready.wait()
+                if self.coalesce > 0:
+                    # Give any related messages a chance to show up
+                    await asyncio.sleep(self.coalesce)
+                self.ready.clear()
+                while self.replay is not None and not self.closed:
+                    await self._sendReplay()
+                if self.queue and not self.closed:
+                    data = b''.join(self.queue)
+                    self.queue.clear()
+                    self.writer.write(data)
+                    await self.writer.drain()
+        except (ConnectionError, OSError):
+            pass
+            
+    async def watch(self, reader, broadcaster):
+        """
+        Read subscription requests from the client until it disconnects.
+        """
+        
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if self.events or not line.strip():
+                    continue
+                    
+                try:
+                    self.subscription = Subscription.fromRequest(line)
+                    print("Updated subscription for %s, port %i" % self.address)
+                    if self.subscription.replay:
+                        broadcaster.replay(self, self.subscription.replay)
+                except ValueError as e:
+                    print("Ignoring request from %s, port %i: %s" % (self.address+(str(e),)))
+        except (ConnectionError, OSError, ValueError):
+            pass
+
+
+class MulticastProtocol(asyncio.DatagramProtocol):
+    """
+    Protocol that hands the multicast messages received to a Broadcaster.
+    """
+    
+    def __init__(self, broadcaster):
+        self.broadcaster = broadcaster
+        
+    def datagram_received(self, data, addr):
+        self.broadcaster.receive(data)
+
 
-def EFM100(mcastAddr="224.168.2.9", mcastPort=7163):
+class Broadcaster(object):
     """
-    Function responsible for reading the UDP multi-cast packets and printing them
-    to the screen.
+    Class to fan the messages received from the multicast feed out to all of
+    the connected TCP clients.
     """
     
+    def __init__(self, queueSize=QUEUE_SIZE, policy='drop-oldest', ringSize=RING_SIZE, ringAge=RING_AGE,
+                 replayWindow=0.0, framing='newline', coalesce=COALESCE):
+        self.queueSize = queueSize
+        self.policy = policy
+        self.framing = framing
+        self.coalesce = coalesce
+        self.ringAge = float(ringAge)
+        self.replayWindow = float(replayWindow)
+        
+        self.clients = set()
+        self.tracker = SequenceTracker()
+        self.tlast = time.time()
+        
+        # Ring of (time received, framed data, decoded message, event) for the
+        # recent messages and the absolute index of the oldest one in it.  The
+        # indices let a replay work from the ring as it was when the client
+        # connected without copying it.
+        self.ring = deque(maxlen=int(ringSize))
+        self.ringStart = 0
+        self._binary = False
+        
+        # Current state of things for /latest and a cached copy of the response
+        self.latest = {'field': None, 'delta': None, 'lightning': None, 'nodata': None,
+                       'alerts': {'field': 'none', 'lightning': False}}
+        self._latest = None
+        
+    def receive(self, data):
+        """
+        Handle a message from the multicast feed.
+        """
+        
+        self.tlast = time.time()
+        try:
+            msg = decode(data)
+            self.tracker.update(msg.seq)
+        except ValueError:
+            msg = None
+        self._binary = msg is not None and not data.startswith(b'[')
+        
+        data = frameMessage(data, self.framing)
+        event = None
+        if msg is not None:
+            event = eventMessage(msg)
+            self.update(msg)
+        if len(self.ring) == self.ring.maxlen:
+            self.ringStart += 1
+        self.ring.append((self.tlast, data, msg, event))
+        while self.ring[0][0] < self.tlast - self.ringAge:
+            self.ring.popleft()
+            self.ringStart += 1
+        
+        self.publish(data, msg, event)
+        
+    def update(self, msg):
+        """
+        Update the current state with a decoded Message.
+        """
+        
+        state = self.latest
+        if msg.type == 'FIELD':
+            state['field'] = {'time': msg.time, 'value': msg.values[0]}
+        elif msg.type == 'DELTA':
+            state['delta'] = {'time': msg.time, 'value': msg.values[0]}
+        elif msg.type == 'LIGHTNING':
+            state['lightning'] = {'time': msg.time, 'distance': msg.values[0]}
+            state['alerts']['lightning'] = True
+        elif msg.type == 'WARNING':
+            state['alerts']['field'] = 'very high' if msg.values[0] == VERY_HIGH_FIELD else 'high'
+        elif msg.type == 'NOTICE':
+            if msg.values[0] == FIELD_CLEARED:
+                state['alerts']['field'] = 'none'
+            elif msg.values[0] == LIGHTNING_CLEARED:
+                state['alerts']['lightning'] = False
+        elif msg.type == 'NODATA':
+            state['nodata'] = {'time': msg.time, 'age': msg.values[0]}
+        else:
+            return
+        if msg.type != 'NODATA':
+            state['nodata'] = None
+        self._latest = None
+        
+    def latestResponse(self):
+        """
+        Return the HTTP response for /latest.  It is only rebuilt when the
+        state changes.
+        """
+        
+        if self._latest is None:
+            self._latest = httpResponse("200 OK", json.dumps(self.latest).encode(), 'application/json')
+        return self._latest
+        
+    def respond(self, url):
+        """
+        Return the HTTP response for a GET request of a parsed URL other than
+        /events, or None if there is nothing there.
+        """
+        
+        if url.path == '/latest':
+            return self.latestResponse()
+        return None
+        
+    def marker(self, code, events=False):
+        """
+        Return a framed REPLAY message with the given code in the same format as
+        the feed, or as a Server-Sent Event.  Like the text version, the
+        binary version decodes without a sequence number so that it does not
+        disturb a SequenceTracker downstream.
+        """
+        
+        if events:
+            return eventMessage(decode(formatText('REPLAY', time.time(), (code,))))
+        elif self._binary:
+            data = encodePacket('REPLAY', 0, time.time(), (code,))
+        else:
+            data = formatText('REPLAY', time.time(), (code,)).encode()
+        return frameMessage(data, self.framing)
+        
+    def replay(self, client, window):
+        """
+        Have a client catch up on the last `window` seconds of messages.
+        """
+        
+        client.startReplay(self, self.ringStart, self.ringStart + len(self.ring), time.time() - window,
+                           self.marker(REPLAY_BEGIN, client.events), self.marker(REPLAY_END, client.events))
+        
+    def publish(self, data, msg=None, event=None):
+        """
+        Queue a framed message for all of the clients that have subscribed to
+        it, disconnecting any that have fallen too far behind.  `msg` is the
+        decoded version of the message used for the filtering and `event` is
+        the version sent to events clients.
+        """
+        
+        for client in list(self.clients):
+            payload = event if client.events else data
+            if payload is None or not client.subscription.accept(msg):
+                continue
+            if not client.put(payload):
+                print("Disconnecting %s, port %i - too far behind" % client.address)
+                client.close()
+                self.clients.discard(client)
+                
+    async def handleClient(self, reader, writer):
+        """
+        Serve a newly connected client.
+        """
+        
+        client = Client(writer, queueSize=self.queueSize, policy=self.policy, coalesce=self.coalesce)
+        await self._serve(client, reader)
+        
+    async def handleHTTP(self, reader, writer):
+        """
+        Serve a HTTP request.
+        """
+        
+        try:
+            request = await reader.readline()
+            while True:
+                line = await reader.readline()
+                if not line.strip():
+                    break
+            method, target, version = request.decode('latin-1').split()
+        except (ConnectionError, OSError, ValueError):
+            writer.close()
+            return
+            
+        url = urlparse(target)
+        if method != 'GET':
+            writer.write(httpResponse("405 Method Not Allowed", b'', headers=("Allow: GET",)))
+        elif url.path == '/events':
+            try:
+                subscription = Subscription.fromQuery(url.query)
+            except ValueError as e:
+                writer.write(httpResponse("400 Bad Request", str(e).encode()))
+            else:
+                writer.write(httpResponse("200 OK", None, 'text/event-stream'))
+                client = Client(writer, queueSize=self.queueSize, policy=self.policy, coalesce=self.coalesce,
+                                events=True)
+                client.subscription = subscription
+                await self._serve(client, reader)
+                return
+        else:
+            writer.write(self.respond(url) or httpResponse("404 Not Found", b'Not found'))
+            
+        try:
+            await writer.drain()
+            writer.close()
+        except (ConnectionError, OSError):
+            pass
+            
+    async def _serve(self, client, reader):
+        """
+        Send messages to a client until it disconnects.
+        """
+        
+        self.clients.add(client)
+        kind = 'events connection' if client.events else 'connection'
+        print("Accepted new %s from %s, port %i" % ((kind,)+client.address))
+        replay = client.subscription.replay or self.replayWindow
+        if replay > 0:
+            self.replay(client, replay)
+            
+        tasks = [asyncio.ensure_future(client.run()), asyncio.ensure_future(client.watch(reader, self))]
+        try:
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            for task in tasks:
+                task.cancel()
+            self.clients.discard(client)
+            if not client.closed:
+                client.close()
+            print("Closed connection to %s, port %i" % client.address)
+            if client.dropped:
+                print("  dropped %i messages" % client.dropped)
+                
+    async def watchdog(self):
+        """
+        Send out a NODATA message whenever nothing has been received from the
+        multicast feed for `timeout` seconds.
+        """
+        
+        tnodata = 0.0
+        while True:
+            await asyncio.sleep(timeout / 5.0)
+            t = time.time()
+            age = t - self.tlast
+            if age >= timeout and t - tnodata >= timeout:
+                data = formatText('NODATA', t, (age,)).encode()
+                msg = decode(data)
+                self.update(msg)
+                self.publish(frameMessage(data, self.framing), msg, eventMessage(msg))
+                tnodata = t
+                
+    async def reporter(self, interval):
+        """
+        Report the message loss counters every `interval` seconds.
+        """
+        
+        while True:
+            await asyncio.sleep(interval)
+            print("Messages: %s" % self.tracker)
+
+
+async def serve(broadcaster, mcastAddr="224.168.2.9", mcastPort=7163, httpPort=0, report_interval=0.0,
+                tcp=True):
+    """
+    Coroutine that listens for the UDP multi-cast packets, TCP connections
+    if `tcp` is True, and HTTP requests if `httpPort` is given, and runs until
+    cancelled.
+    """
+    
+    loop = asyncio.get_running_loop()
+    
     #create a UDP socket
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
     #allow multiple sockets to use the same PORT number
@@ -41,57 +622,50 @@ def EFM100(mcastAddr="224.168.2.9", mcastPort=7163):
     #The address for the multicast group is the third param
     status = sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP,
             socket.inet_aton(mcastAddr) + socket.inet_aton("0.0.0.0"))
-    sock.setblocking(1)
-    sock.settimeout(timeout)
+    sock.setblocking(False)
+    transport, protocol = await loop.create_datagram_endpoint(lambda: MulticastProtocol(broadcaster), sock=sock)
     
     #setup the TCP connection handling
-    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server.bind(('0.0.0.0', mcastPort))
-    server.listen(5)
-    server.setblocking(False)
-    servers = [server,]
-    connections, addresses = [], []
+    servers = []
+    if tcp:
+        servers.append(await asyncio.start_server(broadcaster.handleClient, '0.0.0.0', mcastPort, backlog=64))
+    if httpPort > 0:
+        servers.append(await asyncio.start_server(broadcaster.handleHTTP, '0.0.0.0', httpPort, backlog=64))
+        
+    tasks = [asyncio.ensure_future(broadcaster.watchdog()),]
+    if report_interval > 0:
+        tasks.append(asyncio.ensure_future(broadcaster.reporter(report_interval)))
+        
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        for server in servers:
+            server.close()
+        transport.close()
+        for client in list(broadcaster.clients):
+            client.close()
+
+
+def EFM100(mcastAddr="224.168.2.9", mcastPort=7163, queue_size=QUEUE_SIZE, drop_policy='drop-oldest',
+           ring_size=RING_SIZE, ring_age=RING_AGE, replay_window=0.0, framing='newline', coalesce=COALESCE,
+           http_port=0, report_interval=0.0):
+    """
+    Function responsible for reading the UDP multi-cast packets and sending
+    them on to the TCP subscribers.  Lost, duplicated, and reordered messages
+    are counted and reported every `report_interval` seconds, if it is
+    greater than zero, and on exit.
+    """
     
-    # Main reading loop
-    tlast = datetime.utcnow()
+    broadcaster = Broadcaster(queueSize=queue_size, policy=drop_policy, ringSize=ring_size, ringAge=ring_age,
+                              replayWindow=replay_window, framing=framing, coalesce=coalesce)
     try:
-        while True:
-            try:
-                data, addr = sock.recvfrom(1024)
-                tlast = datetime.utcnow()
-            except socket.error as e:
-                t = datetime.utcnow()
-                age = t - tlast
-                data = "[%s] NODATA: No data received after %.1f s" % (t.strftime(dateFmt), age.total_seconds())
-                try:
-                    data = data.encode()
-                except AttributeError:
-                    pass
-                    
-            readable, writable, errored = select.select(servers, connections, [])
-            for s in readable:
-                if s is server:
-                    client_socket, address = server.accept()
-                    connections.append(client_socket)
-                    addresses.append(address)
-                    print("Accepted new connection from %s, port %i" % address)
-            for s in writable:
-                try:
-                    if data is not None:
-                        s.send(data)
-                except socket.error as e:
-                    idx = connections.index(s)
-                    print("Closed connection to %s, port %i" % addresses[idx])
-                    s.close()
-                    del connections[idx]
-                    del addresses[idx]
-                    
-                    
+        asyncio.run(serve(broadcaster, mcastAddr=mcastAddr, mcastPort=mcastPort, httpPort=http_port,
+                          report_interval=report_interval))
     except KeyboardInterrupt:
-        server.close()
-        sock.close()
-        
         print('')
+        print("Messages: %s" % broadcaster.tracker)
 
 
 if __name__ == "__main__":
@@ -103,7 +677,28 @@ if __name__ == "__main__":
                         help='mulitcast address to connect to')
     parser.add_argument('-p', '--port', type=int, default=7163,
                         help='multicast port to connect on')
+    parser.add_argument('-q', '--queue-size', type=int, default=QUEUE_SIZE,
+                        help='maximum number of messages waiting to be sent to a client')
+    parser.add_argument('-d', '--drop-policy', type=str, choices=DROP_POLICIES, default='drop-oldest',
+                        help='what to do with a client that has a full queue')
+    parser.add_argument('-n', '--ring-size', type=int, default=RING_SIZE,
+                        help='maximum number of recent messages to keep for new clients')
+    parser.add_argument('-g', '--ring-age', type=float, default=RING_AGE/60,
+                        help='maximum age in minutes of the recent messages to keep for new clients')
+    parser.add_argument('-w', '--replay-window', type=float, default=0.0,
+                        help='minutes of recent messages to send to new clients; 0 = only on request')
+    parser.add_argument('-f', '--framing', type=str, choices=FRAMINGS, default='newline',
+                        help='how to frame the messages sent to clients; newline only works with the text feed')
+    parser.add_argument('-c', '--coalesce', type=float, default=COALESCE*1000,
+                        help='time in ms to wait for more messages before sending to a client')
+    parser.add_argument('-t', '--http-port', type=int, default=0,
+                        help='port to serve the /events and /latest HTTP endpoints on; 0 = disabled')
+    parser.add_argument('-r', '--report-interval', type=float, default=0.0,
+                        help='interval in seconds for reporting lost messages; 0 = only on exit')
     args = parser.parse_args()
     
-    EFM100(mcastAddr=args.address, mcastPort=args.port)
-    
+    EFM100(mcastAddr=args.address, mcastPort=args.port, queue_size=args.queue_size,
+           drop_policy=args.drop_policy, ring_size=args.ring_size, ring_age=60*args.ring_age,
+           replay_window=60*args.replay_window, framing=args.framing, coalesce=args.coalesce/1000.0,
+           http_port=args.http_port, report_interval=args.report_interval)
+
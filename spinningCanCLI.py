@@ -12,16 +12,16 @@ import time
 import socket
 import argparse
 
-import re
-from datetime import datetime
+from feed import decode, formatMessage, SequenceTracker
 
-dataRE = re.compile(r'^\[(?P<date>.*)\] (?P<type>[A-Z]*): (?P<data>.*)$')
 
-
-def EFM100(mcastAddr="224.168.2.9", mcastPort=7163, print_field=False, print_warning=False):
+def EFM100(mcastAddr="224.168.2.9", mcastPort=7163, print_field=False, print_warning=False, print_samples=False,
+           report_interval=0.0):
     """
     Function responsible for reading the UDP multi-cast packets and printing them
-    to the screen.
+    to the screen.  Lost, duplicated, and reordered messages are counted and
+    reported every `report_interval` seconds, if it is greater than zero, and
+    on exit.
     """
     
     #create a UDP socket
@@ -38,30 +38,42 @@ def EFM100(mcastAddr="224.168.2.9", mcastPort=7163, print_field=False, print_war
             socket.inet_aton(mcastAddr) + socket.inet_aton("0.0.0.0"))
     sock.setblocking(1)
 
+    # Message loss accounting
+    tracker = SequenceTracker()
+    lastReport = time.time()
+    
     # Main reading loop
     try:
         while True:
             try:
                 data, addr = sock.recvfrom(1024)
 
-                try:
-                    data = data.decode('ascii')
-                except AttributeError:
-                    pass
-                mtch = dataRE.match(data)
-                if print_field and (mtch.group('type') in ['FIELD', 'DELTA']):
-                    print(data)
-                if print_warning and mtch.group('type') in ['WARNING',]:
-                    print(data)
-                if mtch.group('type') in ['LIGHTNING', 'NOTICE']:
-                    print(data)
+                # Works for both the text and binary feeds
+                msg = decode(data)
+                tracker.update(msg.seq)
+                
+                if print_field and (msg.type in ['FIELD', 'DELTA']):
+                    print(formatMessage(msg))
+                if print_warning and msg.type in ['WARNING',]:
+                    print(formatMessage(msg))
+                if print_samples and msg.type in ['SAMPLES',]:
+                    print(formatMessage(msg))
+                if msg.type in ['LIGHTNING', 'NOTICE']:
+                    print(formatMessage(msg))
 
             except socket.error as e:
                 pass
+            except ValueError as e:
+                pass
+                
+            if report_interval > 0 and time.time() - lastReport >= report_interval:
+                print("Messages: %s" % tracker, file=sys.stderr)
+                lastReport = time.time()
                 
     except KeyboardInterrupt:
         sock.close()
         print('')
+        print("Messages: %s" % tracker, file=sys.stderr)
 
 
 if __name__ == "__main__":
@@ -72,12 +84,17 @@ if __name__ == "__main__":
     parser.add_argument('-a', '--address', type=str, default='224.168.2.9',
                         help='mulitcast address to connect to')
     parser.add_argument('-p', '--port', type=int, default=7163,
-                        help='multicast port to connect on')
+                        help='multicast port to connect on; either the text or the binary feed')
     parser.add_argument('-f', '--field', action='store_true',
                         help='print out electric field and field change information')
     parser.add_argument('-w', '--warning', action='store_true',
                         help='print out high field/very high field warnings')
+    parser.add_argument('-s', '--samples', action='store_true',
+                        help='print out full rate sample packets; binary feed only')
+    parser.add_argument('-r', '--report-interval', type=float, default=0.0,
+                        help='interval in seconds for reporting lost messages; 0 = only on exit')
     args = parser.parse_args()
     
-    EFM100(mcastAddr=args.address, mcastPort=args.port, print_field=args.field, print_warning=args.warning)
+    EFM100(mcastAddr=args.address, mcastPort=args.port, print_field=args.field, print_warning=args.warning,
+           print_samples=args.samples, report_interval=args.report_interval)
     
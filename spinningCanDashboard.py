@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Serve a web dashboard for the lightning data served up by spinningCan.py.
+
+A single process joins the multicast feed, keeps the history of the field
+and field change, the lightning strikes, and the alert state, and serves
+them to any number of web browsers over HTTP:
+  /         - the dashboard page (dashboard.html), which does all of its own
+              plotting
+  /history  - a JSON snapshot of the field, field change, and lightning
+              strikes over the last `span` seconds, up to 24 h, e.g.,
+              /history?span=3600, from the resolution that matches the span
+  /events   - a Server-Sent Events stream of the feed
+  /latest   - a JSON snapshot of the current field, field change, last
+              strike, and alert state
+/events and /latest work the same way as they do in spinningCanBroadcast.py.
+Nothing is drawn on the server and the /history responses are shared by all
+of the viewers so adding more viewers costs very little.
+"""
+
+import os
+import json
+import numpy
+import asyncio
+import argparse
+from urllib.parse import parse_qs
+
+from history import FieldHistory
+from spinningCanBroadcast import QUEUE_SIZE, DROP_POLICIES, COALESCE, httpResponse, Broadcaster, serve
+
+
+# Page served up at /
+PAGE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dashboard.html')
+
+# Default and longest spans in seconds for /history
+DEFAULT_SPAN = 180.0
+MAX_SPAN = 86400.0
+
+
+def _series(history, span):
+    """
+    Return the bin width and a dictionary of the bin times, minimums,
+    maximums, means, and number of values for the last `span` seconds of a
+    FieldHistory.
+    """
+    
+    level = history.level(span)
+    times, mins, maxs, means = level.data()
+    counts = level.counts()
+    keep = times >= history.last() - span
+    return level.width, {'time': numpy.round(times[keep], 2).tolist(),
+                         'min': numpy.round(mins[keep], 3).tolist(),
+                         'max': numpy.round(maxs[keep], 3).tolist(),
+                         'mean': numpy.round(means[keep], 3).tolist(),
+                         'count': counts[keep].astype(int).tolist()}
+
+
+class Dashboard(Broadcaster):
+    """
+    Class that keeps the history shown by the dashboard in addition to
+    serving up events and the latest state like a Broadcaster does.
+    """
+    
+    def __init__(self, page=PAGE, queueSize=QUEUE_SIZE, policy='drop-oldest', coalesce=COALESCE):
+        Broadcaster.__init__(self, queueSize=queueSize, policy=policy, coalesce=coalesce)
+        
+        with open(page, 'rb') as fh:
+            self.page = httpResponse("200 OK", fh.read(), 'text/html; charset=utf-8')
+            
+        self.field = FieldHistory()
+        self.delta = FieldHistory()
+        
+        # Lightning strikes as (UNIX epoch, distance in km) pairs
+        self.strikes = numpy.zeros((0, 2), dtype=numpy.float64)
+        
+        # Cached /history responses by span, rounded up to a whole number of bins
+        self._history = {}
+        
+    def update(self, msg):
+        """
+        Update the current state and history with a decoded Message.
+        """
+        
+        Broadcaster.update(self, msg)
+        if msg.type == 'FIELD':
+            self.field.append(msg.time, msg.values[0])
+        elif msg.type == 'DELTA':
+            self.delta.append(msg.time, msg.values[0])
+        elif msg.type == 'LIGHTNING':
+            self.strikes = numpy.append(self.strikes, [[msg.time, msg.values[0]]], axis=0)
+            self.strikes = self.strikes[self.strikes[:,0] >= msg.time - MAX_SPAN]
+        else:
+            return
+        self._history.clear()
+        
+    def historyResponse(self, span):
+        """
+        Return the HTTP response for /history for the last `span` seconds, up
+        to MAX_SPAN.  The span is rounded up to a whole number of bins and the
+        response is only rebuilt when the history changes.
+        """
+        
+        span = min(span, MAX_SPAN)
+        width = self.field.level(span).width
+        span = float(numpy.ceil(span / width) * width)
+        try:
+            return self._history[span]
+        except KeyError:
+            pass
+            
+        width, field = _series(self.field, span)
+        width, delta = _series(self.delta, span)
+        
+        # Keep the first strike in each bin
+        strikes = self.strikes[self.strikes[:,0] >= self.field.last() - span]
+        strikes = strikes[numpy.unique(numpy.floor(strikes[:,0] / width), return_index=True)[1]]
+        
+        body = {'span': span, 'width': width, 'field': field, 'delta': delta,
+                'strikes': numpy.round(strikes, 2).tolist(), 'latest': self.latest}
+        self._history[span] = httpResponse("200 OK", json.dumps(body).encode(), 'application/json')
+        return self._history[span]
+        
+    def respond(self, url):
+        """
+        Return the HTTP response for a GET request of a parsed URL other than
+        /events, or None if there is nothing there.
+        """
+        
+        if url.path in ('/', '/index.html'):
+            return self.page
+        elif url.path == '/history':
+            try:
+                span = float(parse_qs(url.query).get('span', [DEFAULT_SPAN,])[-1])
+                if not span > 0:
+                    raise ValueError("span must be greater than zero")
+            except ValueError as e:
+                return httpResponse("400 Bad Request", str(e).encode())
+            return self.historyResponse(span)
+        return Broadcaster.respond(self, url)
+
+
+def EFM100(mcastAddr="224.168.2.9", mcastPort=7163, http_port=8080, queue_size=QUEUE_SIZE,
+           drop_policy='drop-oldest', coalesce=COALESCE, report_interval=0.0):
+    """
+    Function responsible for reading the UDP multi-cast packets and serving
+    up the dashboard.  Lost, duplicated, and reordered messages are counted
+    and reported every `report_interval` seconds, if it is greater than zero,
+    and on exit.
+    """
+    
+    dashboard = Dashboard(queueSize=queue_size, policy=drop_policy, coalesce=coalesce)
+    print("Serving the dashboard on port %i" % http_port)
+    try:
+        asyncio.run(serve(dashboard, mcastAddr=mcastAddr, mcastPort=mcastPort, httpPort=http_port,
+                          report_interval=report_interval, tcp=False))
+    except KeyboardInterrupt:
+        print('')
+        print("Messages: %s" % dashboard.tracker)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='read data from a spinningCan.py lightning data server and serve it as a web dashboard',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+            )
+    parser.add_argument('-a', '--address', type=str, default='224.168.2.9',
+                        help='mulitcast address to connect to')
+    parser.add_argument('-p', '--port', type=int, default=7163,
+                        help='multicast port to connect on')
+    parser.add_argument('-t', '--http-port', type=int, default=8080,
+                        help='port to serve the dashboard on')
+    parser.add_argument('-q', '--queue-size', type=int, default=QUEUE_SIZE,
+                        help='maximum number of messages waiting to be sent to a viewer')
+    parser.add_argument('-d', '--drop-policy', type=str, choices=DROP_POLICIES, default='drop-oldest',
+                        help='what to do with a viewer that has a full queue')
+    parser.add_argument('-c', '--coalesce', type=float, default=COALESCE*1000,
+                        help='time in ms to wait for more messages before sending to a viewer')
+    parser.add_argument('-r', '--report-interval', type=float, default=0.0,
+                        help='interval in seconds for reporting lost messages; 0 = only on exit')
+    args = parser.parse_args()
+    if args.http_port <= 0:
+        parser.error("the HTTP port must be greater than zero")
+        
+    EFM100(mcastAddr=args.address, mcastPort=args.port, http_port=args.http_port,
+           queue_size=args.queue_size, drop_policy=args.drop_policy, coalesce=args.coalesce/1000.0,
+           report_interval=args.report_interval)
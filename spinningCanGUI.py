@@ -12,8 +12,8 @@ import argparse
 
 import wx
 import threading
+from collections import deque
 
-import re
 from time import sleep
 from datetime import datetime
 
@@ -25,28 +25,7 @@ from matplotlib.dates import *
 from matplotlib.ticker import *
 import pylab
 
-#----------------------------------------------------------------------
-# Create an own event type, so that GUI updates can be delegated
-# this is required as on some platforms only the main thread can
-# access the GUI without crashing. wxMutexGuiEnter/wxMutexGuiLeave
-# could be used too, but an event is more elegant.
-
-SOCKETRX = wx.NewEventType()
-# bind to serial data receive events
-EVT_SOCKETRX = wx.PyEventBinder(SOCKETRX, 0)
-
-class SocketRxEvent(wx.PyCommandEvent):
-    eventType = SOCKETRX
-    def __init__(self, windowID, data):
-        wx.PyCommandEvent.__init__(self, self.eventType, windowID)
-        self.data = data
-
-    def Clone(self):
-        self.__class__(self.GetId(), self.data)
-
-#----------------------------------------------------------------------
-
-dataRE = re.compile(r'^\[(?P<date>.*)\] (?P<type>[A-Z]*): (?P<data>.*)$')
+from feed import decode, formatMessage, SequenceTracker
 
 ID_CLEAR        = wx.NewId()
 ID_SAVEAS       = wx.NewId()
@@ -54,13 +33,17 @@ ID_SETTINGS     = wx.NewId()
 ID_TERM         = wx.NewId()
 ID_EXIT         = wx.NewId()
 
+# Largest number of messages to hold for the next display update.  If the
+# display falls this far behind the oldest messages are dropped.
+PENDING_SIZE = 4096
+
 
 class EFM100(wx.Frame):
     """
     Simple terminal program for wxPython.
     """
     
-    def __init__(self, parent, id, title, mcastAddr="224.168.2.9", mcastPort=7163):
+    def __init__(self, parent, id, title, mcastAddr="224.168.2.9", mcastPort=7163, maxFrameRate=10.0):
         wx.Frame.__init__(self, parent, id, title=title, size=(800,800))
         
         self.timesF = []
@@ -79,12 +62,21 @@ class EFM100(wx.Frame):
         self.thread = None
         self.alive = threading.Event()
         
+        # Messages decoded by the receiver thread that are waiting to be
+        # handled by the GUI and the maximum number of redraws per second
+        self.pending = deque(maxlen=PENDING_SIZE)
+        self.maxFrameRate = maxFrameRate
+        
+        # Message loss accounting
+        self.tracker = SequenceTracker()
+        
         self.initUI()
         self.initEvents()
         self.Show()
         
         self.startThread()
         self.initPlot()
+        self.startTimer()
         
     def initUI(self):
         menubar =  wx.MenuBar()
@@ -110,13 +102,15 @@ class EFM100(wx.Frame):
         self.SetSizer(vbox)
         self.SetAutoLayout(1)
         vbox.Fit(self)
+        
+        self.statusBar = self.CreateStatusBar()
             
     def initEvents(self):
         self.Bind(wx.EVT_MENU, self.onClear,  id = ID_CLEAR)
         self.Bind(wx.EVT_MENU, self.onSaveAs, id = ID_SAVEAS)
         self.Bind(wx.EVT_MENU, self.onExit,   id=ID_EXIT)
         
-        self.Bind(EVT_SOCKETRX, self.onSocketRead)
+        self.Bind(wx.EVT_TIMER, self.onTimer)
 
     def startThread(self):
         """
@@ -146,6 +140,14 @@ class EFM100(wx.Frame):
         self.alive.set()
         self.thread.start()
 
+    def startTimer(self):
+        """
+        Start the timer that updates the display.
+        """
+        
+        self.timer = wx.Timer(self)
+        self.timer.Start(max(1, int(round(1000.0/self.maxFrameRate))))
+
     def stopThread(self):
         """
         Stop the receiver thread, wait util it's finished.
@@ -191,6 +193,9 @@ class EFM100(wx.Frame):
         Draw the plot.
         """
         
+        if not self.timesF:
+            return
+            
         xmin = self.timesF[0]
         xmax = self.timesF[-1]
         
@@ -242,6 +247,7 @@ class EFM100(wx.Frame):
         Called on application shutdown.
         """
         
+        self.timer.Stop()               #stop display updates
         self.stopThread()               #stop reader thread
         self.Destroy()                  #close windows, exit app
 
@@ -270,59 +276,76 @@ class EFM100(wx.Frame):
         """
         
         self.textCtrl.Clear()
+        self.tracker.reset()
 
-    def onSocketRead(self, event):
+    def onTimer(self, event):
         """
-        Handle input from the serial port.
+        Handle all of the messages that have come in since the last update
+        and then redraw the plot once.
         """
         
-        text = event.data
+        if not self.pending:
+            return
+            
+        redraw = False
+        for i in range(len(self.pending)):
+            msg = self.pending.popleft()
+            self.tracker.update(msg.seq)
+            redraw |= self.onMessage(msg)
+        self.statusBar.SetStatusText("Messages: %s" % self.tracker)
+        
+        if redraw:
+            self.drawPlot()
+            
+    def onMessage(self, msg):
+        """
+        Handle a message from spinningCan.py.  Returns True if the plot needs
+        to be redrawn.
+        """
         
-        try:
-            text = text.decode('ascii')
-        except AttributeError:
-            pass
-        mtch = dataRE.match(text)
-        t = datetime.strptime(mtch.group('date'), "%Y-%m-%d %H:%M:%S.%f")
-        if mtch.group('type') == 'FIELD':
-            field, junk = mtch.group('data').split(None, 1)
+        t = datetime.utcfromtimestamp(msg.time)
+        if msg.type == 'FIELD':
+            field = msg.values[0]
             self.timesF.append(t)
-            self.fields.append(float(field))
+            self.fields.append(field)
             
             if len(self.timesF) > self.nKeep:
                 self.timesF = self.timesF[1:(self.nKeep+1)]
                 self.fields = self.fields[1:(self.nKeep+1)]
-            
-            #self.drawPlot()
-        elif mtch.group('type') == 'DELTA':
-            field, junk = mtch.group('data').split(None, 1)
+        elif msg.type == 'DELTA':
+            field = msg.values[0]
             self.timesD.append(t)
-            self.deltas.append(float(field))
+            self.deltas.append(field)
             
             if len(self.timesD) > self.nKeep:
                 self.timesD = self.timesD[1:(self.nKeep+1)]
                 self.deltas = self.deltas[1:(self.nKeep+1)]
-            
-            self.drawPlot()
-        elif mtch.group('type') == 'LIGHTNING':
+        elif msg.type == 'SAMPLES':
+            # The full rate samples are not shown
+            return False
+        elif msg.type == 'LIGHTNING':
             self.markLightningEvent(t)
             
-            self.textCtrl.AppendText(text+'\n')
+            self.textCtrl.AppendText(formatMessage(msg)+'\n')
         else:
-            self.textCtrl.AppendText(text+'\n')
+            self.textCtrl.AppendText(formatMessage(msg)+'\n')
+            return False
+        return True
 
     def SocketThread(self):
         """
-        Thread that handles the incomming traffic. Does the basic input 
-        transformation (newlines) and generates an SocketRxEvent.
+        Thread that handles the incomming traffic. Decodes the messages and
+        queues them up for the next display update.
         """
         
         while True:
             try:
                 data, addr = self.sock.recvfrom(1024)
-                event = SocketRxEvent(self.GetId(), data)
-                self.GetEventHandler().AddPendingEvent(event)
             except socket.error as e:
+                continue
+            try:
+                self.pending.append(decode(data))
+            except ValueError:
                 pass
 
 
@@ -335,9 +358,12 @@ if __name__ == "__main__":
                         help='mulitcast address to connect to')
     parser.add_argument('-p', '--port', type=int, default=7163,
                         help='multicast port to connect on')
+    parser.add_argument('-f', '--frame-rate', type=float, default=10.0,
+                        help='maximum number of times per second to redraw the display')
     args = parser.parse_args()
     
     app = wx.App(0)
-    frame = EFM100(None, -1, "EFM-100 Lightning Detector", mcastAddr=args.address, mcastPort=args.port)
+    frame = EFM100(None, -1, "EFM-100 Lightning Detector", mcastAddr=args.address, mcastPort=args.port,
+                   maxFrameRate=args.frame_rate)
     app.MainLoop()
     
@@ -12,8 +12,8 @@ import argparse
 
 import wx
 import threading
+from collections import deque
 
-import re
 from time import sleep
 from datetime import datetime
 
@@ -21,32 +21,27 @@ import matplotlib
 matplotlib.use('WXAgg')
 from matplotlib.figure import Figure
 from matplotlib.backends.backend_wxagg import FigureCanvasWxAgg
+from matplotlib.collections import LineCollection
 from matplotlib.dates import *
 from matplotlib.ticker import *
 import pylab
+import numpy
 
-#----------------------------------------------------------------------
-# Create an own event type, so that GUI updates can be delegated
-# this is required as on some platforms only the main thread can
-# access the GUI without crashing. wxMutexGuiEnter/wxMutexGuiLeave
-# could be used too, but an event is more elegant.
+from feed import decode, formatMessage, SequenceTracker
+from history import FieldHistory
 
-SOCKETRX = wx.NewEventType()
-# bind to serial data receive events
-EVT_SOCKETRX = wx.PyEventBinder(SOCKETRX, 0)
 
-class SocketRxEvent(wx.PyCommandEvent):
-    eventType = SOCKETRX
-    def __init__(self, windowID, data):
-        wx.PyCommandEvent.__init__(self, self.eventType, windowID)
-        self.data = data
+# matplotlib date number of the UNIX epoch
+_EPOCH = date2num(datetime(1970, 1, 1))
 
-    def Clone(self):
-        self.__class__(self.GetId(), self.data)
 
-#----------------------------------------------------------------------
+def toDateNum(t):
+    """
+    Convert a UNIX epoch in seconds to a matplotlib date number.
+    """
+    
+    return _EPOCH + t / 86400.0
 
-dataRE = re.compile(r'^\[(?P<date>.*)\] (?P<type>[A-Z]*): (?P<data>.*)$')
 
 ID_CLEAR        = wx.NewId()
 ID_SAVEAS       = wx.NewId()
@@ -54,24 +49,221 @@ ID_SETTINGS     = wx.NewId()
 ID_TERM         = wx.NewId()
 ID_EXIT         = wx.NewId()
 
+# Largest number of messages to hold for the next display update.  If the
+# display falls this far behind the oldest messages are dropped.
+PENDING_SIZE = 4096
+
+# Spans of time that can be shown in the plot windows
+VIEW_SPANS = [(wx.NewId(), "Last 3 Minutes",   180),
+              (wx.NewId(), "Last 30 Minutes",  1800),
+              (wx.NewId(), "Last 3 Hours",     10800),
+              (wx.NewId(), "Last 24 Hours",    86400)]
+
+# Number of bins shown for each of the spans.  Each span gets a resolution of
+# its own that holds exactly this many bins.
+PLOT_BINS = 180
+
+
+class TracePlot(object):
+    """
+    Class to manage one of the scrolling plots in the GUI.  The data are kept
+    in a FieldHistory and the plot shows the mean and the min/max range from
+    the resolution that covers the span of time being shown.  Lightning
+    strikes are kept as an array of times and drawn, at most one per bin,
+    with a single LineCollection.
+    
+    Only the data and the strikes are redrawn, using blitting, as new values
+    come in.  The x axis is extended ahead of the data and the y axis is
+    padded so that the whole figure only needs to be redrawn when the data
+    move outside of the current limits or shrink to well inside of them.
+    """
+    
+    def __init__(self, figure, canvas, ylabel, color, span=180, yFloor=-0.05, yCeiling=0.05):
+        self.figure = figure
+        self.canvas = canvas
+        self.history = FieldHistory(widths=[s/PLOT_BINS for id,label,s in VIEW_SPANS], size=PLOT_BINS)
+        self.span = span
+        self.yFloor = yFloor
+        self.yCeiling = yCeiling
+        
+        self.strikes = numpy.zeros(0, dtype=numpy.float64)
+        self.background = None
+        self.stale = True
+        
+        self.axes = self.figure.gca()
+        self.axes.set_axis_bgcolor('white')
+        self.figure.subplots_adjust(left=0.25)
+        pylab.setp(self.axes.get_xticklabels(), fontsize=8)
+        pylab.setp(self.axes.get_yticklabels(), fontsize=8)
+        
+        # plot the data as a line series for the mean and vertical lines
+        # for the range, and save the references to them
+        #
+        self.line = self.axes.plot([], [], linewidth=1, color=color, animated=True)[0]
+        self.range = LineCollection([], colors=color, linewidths=1, alpha=0.4, animated=True)
+        self.axes.add_collection(self.range)
+        
+        # mark the lightning strikes as vertical lines that span the full
+        # height of the plot
+        self.strikeLines = LineCollection([], colors='red', linestyles='--', animated=True,
+                                          transform=self.axes.get_xaxis_transform())
+        self.axes.add_collection(self.strikeLines)
+        
+        self.axes.set_xlabel('Time')
+        self.axes.set_ylabel(ylabel)
+        self.axes.xaxis.set_major_locator(LinearLocator(numticks=6))
+        self.axes.xaxis.set_major_formatter(DateFormatter("%H:%M:%S"))
+        self.axes.grid(True, color='gray')
+        self.figure.autofmt_xdate()
+        
+        self.canvas.mpl_connect('draw_event', self.onDraw)
+        self.canvas.draw()
+        
+    def setSpan(self, span):
+        """
+        Change the span of time shown to `span` seconds.
+        """
+        
+        self.span = span
+        self.stale = True
+        
+    def append(self, t, value):
+        """
+        Add a new UNIX epoch/value pair to the plot.
+        """
+        
+        self.history.append(t, value)
+        
+    def markStrike(self, t):
+        """
+        Mark a lightning strike at UNIX epoch `t` in red.
+        """
+        
+        self.strikes = numpy.append(self.strikes, t)
+        self._setStrikes()
+        
+    def _setStrikes(self):
+        """
+        Update the strike markers from the strikes that fall in the current x
+        axis limits, keeping only the first strike in each bin.
+        """
+        
+        strikes = toDateNum(self.strikes)
+        strikes = strikes[strikes >= self.axes.get_xbound()[0]]
+        width = self.history.level(self.span).width / 86400.0
+        strikes = strikes[numpy.unique(numpy.floor(strikes / width), return_index=True)[1]]
+        
+        segments = numpy.zeros((strikes.size, 2, 2), dtype=numpy.float64)
+        segments[:,:,0] = strikes[:,numpy.newaxis]
+        segments[:,1,1] = 1.0
+        self.strikeLines.set_segments(segments)
+        
+    def _xbound(self):
+        """
+        Return new x axis limits if the data have run off the end of the
+        current ones, otherwise None.
+        """
+        
+        last = toDateNum(self.history.last())
+        xmin, xmax = self.axes.get_xbound()
+        if not self.stale and xmin <= last <= xmax:
+            return None
+            
+        # Leave room for another quarter of the span
+        span = self.span / 86400.0
+        return last - span, last + span/4
+        
+    def _ybound(self, lower, upper):
+        """
+        Return new y axis limits if the data, which run from `lower` to
+        `upper`, have moved outside of the current ones, or have shrunk to
+        less than half of them, otherwise None.
+        """
+        
+        lower = min(lower - 0.05, self.yFloor)
+        upper = max(upper + 0.05, self.yCeiling)
+        ymin, ymax = self.axes.get_ybound()
+        if not self.stale and ymin <= lower and upper <= ymax \
+           and (upper - lower) > (ymax - ymin) / 2:
+            return None
+            
+        # Pad things out by 10% to cut down on redraws
+        pad = (upper - lower) / 10
+        return lower - pad, upper + pad
+        
+    def update(self):
+        """
+        Update the plot with any new data, redrawing the whole figure only if
+        the axis limits need to change.
+        """
+        
+        if len(self.history) == 0:
+            return
+            
+        xbound = self._xbound()
+        if xbound is not None:
+            self.axes.set_xbound(*xbound)
+                
+            # Drop the strikes that are older than the history
+            self.strikes = self.strikes[self.strikes >= self.history.last() - self.history.span]
+            self._setStrikes()
+            
+        # Data from the matching resolution that are in view
+        level = self.history.level(self.span)
+        times, mins, maxs, means = level.data()
+        times = toDateNum(times)
+        visible = times >= self.axes.get_xbound()[0]
+        times, mins, maxs, means = times[visible], mins[visible], maxs[visible], means[visible]
+        
+        self.line.set_data(times, means)
+        segments = numpy.empty((times.size, 2, 2), dtype=numpy.float64)
+        segments[:,:,0] = times[:,numpy.newaxis]
+        segments[:,0,1] = mins
+        segments[:,1,1] = maxs
+        self.range.set_segments(segments)
+        
+        # The resolution holds the span being shown, so its running extrema
+        # are the limits of what is in view
+        ybound = self._ybound(level.min(), level.max()) if times.size else None
+        if xbound is not None or ybound is not None or self.background is None:
+            if ybound is not None:
+                self.axes.set_ybound(*ybound)
+            self.stale = False
+            self.canvas.draw()
+        else:
+            self.canvas.restore_region(self.background)
+            self._drawArtists()
+            
+    def _drawArtists(self):
+        """
+        Draw the data and strikes on top of the background.
+        """
+        
+        self.axes.draw_artist(self.range)
+        self.axes.draw_artist(self.line)
+        self.axes.draw_artist(self.strikeLines)
+        self.canvas.blit(self.axes.bbox)
+            
+    def onDraw(self, event):
+        """
+        Save the background after a full redraw and then draw the data and
+        strikes on top of it.
+        """
+        
+        self.background = self.canvas.copy_from_bbox(self.axes.bbox)
+        self._drawArtists()
+
 
 class EFM100(wx.Frame):
     """
     Simple terminal program for wxPython.
     """
     
-    def __init__(self, parent, id, title, mcastAddr="224.168.2.9", mcastPort=7163):
+    def __init__(self, parent, id, title, mcastAddr="224.168.2.9", mcastPort=7163, maxFrameRate=10.0):
         wx.Frame.__init__(self, parent, id, title=title, size=(800,800))
         
-        self.timesF = []
-        self.fields = []
-        self.timesD = []
-        self.deltas = []
-        self.strikes1 = {}
-        self.strikes2 = {}
-        
-        # Number of points to display in the plot window
-        self.nKeep = 180
+        # Span of time in seconds to display in the plot window
+        self.span = VIEW_SPANS[0][2]
         
         self.mcastAddr = mcastAddr
         self.mcastPort = mcastPort
@@ -80,12 +272,21 @@ class EFM100(wx.Frame):
         self.thread = None
         self.alive = threading.Event()
         
+        # Messages decoded by the receiver thread that are waiting to be
+        # handled by the GUI and the maximum number of redraws per second
+        self.pending = deque(maxlen=PENDING_SIZE)
+        self.maxFrameRate = maxFrameRate
+        
+        # Message loss accounting
+        self.tracker = SequenceTracker()
+        
         self.initUI()
         self.initEvents()
         self.Show()
         
         self.startThread()
         self.initPlot()
+        self.startTimer()
         
     def initUI(self):
         menubar =  wx.MenuBar()
@@ -96,6 +297,11 @@ class EFM100(wx.Frame):
         fileMenu.AppendSeparator()
         fileMenu.Append(ID_EXIT, "&Exit", "", wx.ITEM_NORMAL)
         menubar.Append(fileMenu, "&File")
+        
+        viewMenu = wx.Menu()
+        for id,label,span in VIEW_SPANS:
+            viewMenu.Append(id, label, "", wx.ITEM_RADIO)
+        menubar.Append(viewMenu, "&View")
         self.SetMenuBar(menubar)
 
         panel = wx.Panel(self, -1)
@@ -115,13 +321,17 @@ class EFM100(wx.Frame):
         self.SetSizer(vbox)
         self.SetAutoLayout(1)
         vbox.Fit(self)
+        
+        self.statusBar = self.CreateStatusBar()
             
     def initEvents(self):
         self.Bind(wx.EVT_MENU, self.onClear,  id = ID_CLEAR)
         self.Bind(wx.EVT_MENU, self.onSaveAs, id = ID_SAVEAS)
         self.Bind(wx.EVT_MENU, self.onExit,   id=ID_EXIT)
+        for id,label,span in VIEW_SPANS:
+            self.Bind(wx.EVT_MENU, self.onView, id=id)
         
-        self.Bind(EVT_SOCKETRX, self.onSocketRead)
+        self.Bind(wx.EVT_TIMER, self.onTimer)
 
     def startThread(self):
         """
@@ -151,6 +361,14 @@ class EFM100(wx.Frame):
         self.alive.set()
         self.thread.start()
 
+    def startTimer(self):
+        """
+        Start the timer that updates the display.
+        """
+        
+        self.timer = wx.Timer(self)
+        self.timer.Start(max(1, int(round(1000.0/self.maxFrameRate))))
+
     def stopThread(self):
         """
         Stop the receiver thread, wait util it's finished.
@@ -170,110 +388,26 @@ class EFM100(wx.Frame):
         Create the plotting window and everything it needs.
         """
 
-        self.axes1 = self.figure1.gca()
-        self.axes1.set_axis_bgcolor('white')
-        self.figure1.subplots_adjust(left=0.25)
-
-        self.axes2 = self.figure2.gca()
-        self.axes2.set_axis_bgcolor('white')
-        self.figure2.subplots_adjust(left=0.25)
-        
-        pylab.setp(self.axes1.get_xticklabels(), fontsize=8)
-        pylab.setp(self.axes1.get_yticklabels(), fontsize=8)
-
-        pylab.setp(self.axes2.get_xticklabels(), fontsize=8)
-        pylab.setp(self.axes2.get_yticklabels(), fontsize=8)
-
-        # plot the data as a line series, and save the reference 
-        # to the plotted line series
-        #
-        self.plot1 = self.axes1.plot([2,], [0,], linewidth=1, color='green')[0]
-        self.plot2 = self.axes2.plot([2,], [0,], linewidth=1, color='blue' )[0]
-
-        self.axes1.set_xlabel('Time')
-        self.axes1.set_ylabel('E-Field [kV/m]')
-        self.axes1.xaxis.set_major_locator(LinearLocator(numticks=6))
-        self.axes1.xaxis.set_major_formatter(DateFormatter("%H:%M:%S"))
-        self.figure1.autofmt_xdate()
-
-        self.axes2.set_xlabel('Time')
-        self.axes2.set_ylabel('$\\Delta$ E-Field [kV/m]')
-        self.axes2.xaxis.set_major_locator(LinearLocator(numticks=6))
-        self.axes2.xaxis.set_major_formatter(DateFormatter("%H:%M:%S"))
-        self.figure2.autofmt_xdate()
-        
-        self.canvas1.draw()
-
-        self.canvas2.draw()
+        self.plot1 = TracePlot(self.figure1, self.canvas1, 'E-Field [kV/m]', 'green',
+                               span=self.span, yFloor=-0.05, yCeiling=0.1)
+        self.plot2 = TracePlot(self.figure2, self.canvas2, '$\\Delta$ E-Field [kV/m]', 'blue',
+                               span=self.span, yFloor=-0.05, yCeiling=0.05)
         
     def drawPlot(self):
         """
         Draw the plot.
         """
         
-        xmin = self.timesF[0]
-        xmax = self.timesF[-1]
-        
-        ymin1 = sorted(self.fields)[ 0] - 0.05
-        if ymin1 > -0.05:
-            ymin1 = -0.05
-        ymax1 = sorted(self.fields)[-1] + 0.05
-        if ymax1 < 0.1:
-            ymax1 = 0.1
-
-        ymin2 = sorted(self.deltas)[ 0] - 0.05
-        if ymin2 > -0.05:
-            ymin2 = -0.05
-        ymax2 = sorted(self.deltas)[-1] + 0.05
-        if ymax2 < 0.05:
-            ymax2 = 0.05
-        
-        self.axes1.set_xbound(lower=xmin,  upper=xmax )
-        self.axes1.set_ybound(lower=ymin1, upper=ymax1)
-
-        self.axes2.set_xbound(lower=xmin,  upper=xmax )
-        self.axes2.set_ybound(lower=ymin2, upper=ymax2)
-        
-        self.axes1.grid(True, color='gray')
-        self.plot1.set_xdata(pylab.date2num(self.timesF))
-        self.plot1.set_ydata(self.fields)
-        
-        self.axes2.grid(True, color='gray')
-        self.plot2.set_xdata(pylab.date2num(self.timesD))
-        self.plot2.set_ydata(self.deltas)
-        
-        for t in self.strikes1.keys():
-            if t < xmin:
-                for s in self.strikes1[t]:
-                    self.axes1.lines.remove(s)
-                del self.strikes1[t]
-
-        for t in self.strikes2.keys():
-            if t < xmin:
-                for s in self.strikes2[t]:
-                    self.axes2.lines.remove(s)
-                del self.strikes2[t]
-        
-        self.canvas1.draw()
-
-        self.canvas2.draw()
+        self.plot1.update()
+        self.plot2.update()
         
     def markLightningEvent(self, t):
         """
         Mark a lightning strike in red.
         """
         
-        line, = self.axes1.plot([t,t], [-30,30], color='red', linestyle='--')
-        try:
-            self.strikes1[t].append(line)
-        except KeyError:
-            self.strikes1[t] = [line,]
-
-        line, = self.axes2.plot([t,t], [-30,30], color='red', linestyle='--')
-        try:
-            self.strikes2[t].append(line)
-        except KeyError:
-            self.strikes2[t] = [line,]
+        self.plot1.markStrike(t)
+        self.plot2.markStrike(t)
 
     def onExit(self, event):
         """
@@ -287,6 +421,7 @@ class EFM100(wx.Frame):
         Called on application shutdown.
         """
         
+        self.timer.Stop()               #stop display updates
         self.stopThread()               #stop reader thread
         self.Destroy()                  #close windows, exit app
 
@@ -309,61 +444,82 @@ class EFM100(wx.Frame):
             f.write(text)
             f.close()
     
+    def onView(self, event):
+        """
+        Change the span of time shown in the plot windows.
+        """
+        
+        for id,label,span in VIEW_SPANS:
+            if id == event.GetId():
+                self.span = span
+        self.plot1.setSpan(self.span)
+        self.plot2.setSpan(self.span)
+        self.drawPlot()
+    
     def onClear(self, event):
         """
         Clear contents of output window.
         """
         
         self.textCtrl.Clear()
+        self.tracker.reset()
 
-    def onSocketRead(self, event):
+    def onTimer(self, event):
         """
-        Handle input from the serial port.
+        Handle all of the messages that have come in since the last update
+        and then redraw the plot once.
         """
         
-        text = event.data
-        
-        mtch = dataRE.match(text)
-        t = datetime.strptime(mtch.group('date'), "%Y-%m-%d %H:%M:%S.%f")
-        if mtch.group('type') == 'FIELD':
-            field, junk = mtch.group('data').split(None, 1)
-            self.timesF.append(t)
-            self.fields.append(float(field))
-            
-            if len(self.timesF) > self.nKeep:
-                self.timesF = self.timesF[1:(self.nKeep+1)]
-                self.fields = self.fields[1:(self.nKeep+1)]
-            
-            #self.drawPlot()
-        elif mtch.group('type') == 'DELTA':
-            field, junk = mtch.group('data').split(None, 1)
-            self.timesD.append(t)
-            self.deltas.append(float(field))
-            
-            if len(self.timesD) > self.nKeep:
-                self.timesD = self.timesD[1:(self.nKeep+1)]
-                self.deltas = self.deltas[1:(self.nKeep+1)]
+        if not self.pending:
+            return
             
+        redraw = False
+        for i in range(len(self.pending)):
+            msg = self.pending.popleft()
+            self.tracker.update(msg.seq)
+            redraw |= self.onMessage(msg)
+        self.statusBar.SetStatusText("Messages: %s" % self.tracker)
+        
+        if redraw:
             self.drawPlot()
-        elif mtch.group('type') == 'LIGHTNING':
+            
+    def onMessage(self, msg):
+        """
+        Handle a message from spinningCan.py.  Returns True if the plot needs
+        to be redrawn.
+        """
+        
+        t = msg.time
+        if msg.type == 'FIELD':
+            self.plot1.append(t, msg.values[0])
+        elif msg.type == 'DELTA':
+            self.plot2.append(t, msg.values[0])
+        elif msg.type == 'SAMPLES':
+            # The full rate samples are not shown
+            return False
+        elif msg.type == 'LIGHTNING':
             self.markLightningEvent(t)
             
-            self.textCtrl.AppendText(text+'\n')
+            self.textCtrl.AppendText(formatMessage(msg)+'\n')
         else:
-            self.textCtrl.AppendText(text+'\n')
+            self.textCtrl.AppendText(formatMessage(msg)+'\n')
+            return False
+        return True
 
     def SocketThread(self):
         """
-        Thread that handles the incomming traffic. Does the basic input 
-        transformation (newlines) and generates an SocketRxEvent.
+        Thread that handles the incomming traffic. Decodes the messages and
+        queues them up for the next display update.
         """
         
         while True:
             try:
                 data, addr = self.sock.recvfrom(1024)
-                event = SocketRxEvent(self.GetId(), data)
-                self.GetEventHandler().AddPendingEvent(event)
             except socket.error as e:
+                continue
+            try:
+                self.pending.append(decode(data))
+            except ValueError:
                 pass
 
 
@@ -376,9 +532,12 @@ if __name__ == "__main__":
                         help='mulitcast address to connect to')
     parser.add_argument('-p', '--port', type=int, default=7163,
                         help='multicast port to connect on')
+    parser.add_argument('-f', '--frame-rate', type=float, default=10.0,
+                        help='maximum number of times per second to redraw the display')
     args = parser.parse_args()
     
     app = wx.App(0)
-    frame = EFM100(None, -1, "EFM-100 Lightning Detector", mcastAddr=args.address, mcastPort=args.port)
+    frame = EFM100(None, -1, "EFM-100 Lightning Detector", mcastAddr=args.address, mcastPort=args.port,
+                   maxFrameRate=args.frame_rate)
     app.MainLoop()
     
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+
+"""
+Sweep the lightning detector settings over a set of spinningCan.py
+recordings and report how many strikes and alerts each combination gives.
+
+The recordings are loaded once into shared memory and the combinations of
+settings are divided up among a pool of worker processes.  Each combination
+is run through the same ElectricField and AlertEngine used by spinningCan.py.
+For each one the sweep reports:
+  * detections - samples flagged as lightning during a high field
+  * reports - LIGHTNING messages that would have been sent
+  * field alerts/lightning alerts - number of high field and lightning
+    warning periods, i.e., from the first warning or report to the all clear
+  * field hours/lightning hours - total time spent in those periods
+  * false alarms - lightning alert periods with fewer than --min-reports
+    reports or, if a reference list of strike times is given, reports with no
+    reference strike within --tolerance seconds
+"""
+
+import os
+import sys
+import json
+import copy
+import numpy
+import argparse
+import itertools
+import json_minify
+from multiprocessing import Pool, cpu_count, shared_memory
+
+from efield import ElectricField
+from alerts import AlertEngine
+from feed import FIELD_CLEARED, LIGHTNING_CLEARED
+from recording import readRecording
+from archive import FieldArchive, parseTime
+
+
+# Shared memory arrays for the workers
+_shared = {}
+
+
+def _attach(names, size, segments, reference):
+    """
+    Worker initializer that attaches to the shared memory holding the
+    recordings.
+    """
+    
+    for key,name in names.items():
+        shm = shared_memory.SharedMemory(name=name)
+        _shared[key] = (shm, numpy.ndarray((size,), dtype=numpy.float64, buffer=shm.buf))
+    _shared['segments'] = segments
+    _shared['reference'] = reference
+
+
+def _periods(events, kind, cleared, tEnd):
+    """
+    Return a list of (start, stop) UNIX epochs and the number of reports in
+    each for the alert periods of the given kind ('WARNING' or 'LIGHTNING')
+    in a list of AlertEvents.
+    """
+    
+    periods = []
+    start, count = None, 0
+    for event in events:
+        if event.type == kind:
+            if start is None:
+                start, count = event.time, 0
+            count += 1
+        elif event.type == 'NOTICE' and event.values[0] == cleared and start is not None:
+            periods.append((start, event.time, count))
+            start = None
+    if start is not None:
+        periods.append((start, tEnd, count))
+    return periods
+
+
+def evaluate(job):
+    """
+    Evaluate one combination of settings over all of the recordings and
+    return a dictionary of the results.
+    """
+    
+    config, minReports, tolerance = job
+    times, fields = _shared['times'][1], _shared['fields'][1]
+    reference = _shared['reference']
+    
+    results = {'detections': 0, 'reports': 0, 'field alerts': 0, 'field hours': 0.0,
+               'lightning alerts': 0, 'lightning hours': 0.0, 'false alarms': 0}
+    for start,stop in _shared['segments']:
+        movingField = ElectricField()
+        movingField.updateConfig(config)
+        alerts = AlertEngine()
+        alerts.updateConfig(config)
+        
+        t, f = times[start:stop], fields[start:stop]
+        detection = movingField.detect(t, f)
+        events = alerts.run(movingField, t, f)
+        
+        results['detections'] += int((detection.lightning & detection.high).sum())
+        reports = numpy.array([e.time for e in events if e.type == 'LIGHTNING'])
+        results['reports'] += reports.size
+        
+        field = _periods(events, 'WARNING', FIELD_CLEARED, t[-1])
+        results['field alerts'] += len(field)
+        results['field hours'] += sum(p[1]-p[0] for p in field) / 3600.0
+        
+        lightning = _periods(events, 'LIGHTNING', LIGHTNING_CLEARED, t[-1])
+        results['lightning alerts'] += len(lightning)
+        results['lightning hours'] += sum(p[1]-p[0] for p in lightning) / 3600.0
+        
+        if reference is not None:
+            if reports.size:
+                i = numpy.clip(numpy.searchsorted(reference, reports), 1, reference.size-1)
+                nearest = numpy.minimum(numpy.abs(reports - reference[i-1]), numpy.abs(reports - reference[i]))
+                results['false alarms'] += int((nearest > tolerance).sum())
+        else:
+            results['false alarms'] += sum(1 for p in lightning if p[2] < minReports)
+            
+    return results
+
+
+def _values(text):
+    """
+    Parse a comma separated list of numbers.
+    """
+    
+    return [float(v) for v in text.split(',')]
+
+
+def main(args):
+    # Load the recordings
+    times, fields, segments = [], [], []
+    size = 0
+    for filename in args.filename:
+        if os.path.isdir(filename):
+            epochs, values = FieldArchive(filename).query(args.start, args.stop)
+        else:
+            epochs, values = readRecording(filename)
+            valid = numpy.ones(epochs.size, dtype=bool)
+            if args.start is not None:
+                valid &= (epochs >= parseTime(args.start))
+            if args.stop is not None:
+                valid &= (epochs < parseTime(args.stop))
+            epochs, values = epochs[valid], values[valid]
+        print("Loaded %i samples from '%s'" % (epochs.size, filename))
+        if epochs.size == 0:
+            continue
+            
+        times.append(epochs)
+        fields.append(values)
+        segments.append((size, size+epochs.size))
+        size += epochs.size
+    if size == 0:
+        print("No data to sweep over")
+        sys.exit(1)
+        
+    # Load the reference strike times, if any
+    reference = None
+    if args.reference is not None:
+        with open(args.reference, 'r') as fh:
+            reference = [parseTime(line.split('#', 1)[0].strip().split(',')[0])
+                         for line in fh if line.split('#', 1)[0].strip()]
+        reference = numpy.sort(numpy.array(reference + [-numpy.inf, numpy.inf]))
+        
+    # Copy everything into shared memory
+    names, blocks = {}, []
+    try:
+        for key,data in (('times', times), ('fields', fields)):
+            shm = shared_memory.SharedMemory(create=True, size=size*8)
+            blocks.append(shm)
+            numpy.concatenate(data, out=numpy.ndarray((size,), dtype=numpy.float64, buffer=shm.buf))
+            names[key] = shm.name
+        del times, fields
+        
+        # Build the grid of settings
+        jobs, grid = [], []
+        for mfc,hf,avg in itertools.product(args.min_efield_change, args.high_field, args.average_time):
+            config = copy.deepcopy(args.config_file)
+            config['lightning']['min_efield_change'] = mfc
+            config['efield']['high_field'] = hf
+            config['efield']['average_time'] = avg
+            jobs.append((config, args.min_reports, args.tolerance))
+            grid.append((mfc, hf, avg))
+        print("Sweeping %i combinations over %i samples with %i processes" % (len(jobs), size, args.processes))
+        
+        # Run
+        with Pool(processes=args.processes, initializer=_attach,
+                  initargs=(names, size, segments, reference)) as pool:
+            results = pool.map(evaluate, jobs, chunksize=1)
+    finally:
+        for shm in blocks:
+            shm.close()
+            shm.unlink()
+            
+    # Report
+    keys = ['detections', 'reports', 'field alerts', 'field hours', 'lightning alerts', 'lightning hours',
+            'false alarms']
+    header = ['min_efield_change', 'high_field', 'average_time'] + keys
+    rows = [list(g) + [r[k] for k in keys] for g,r in zip(grid, results)]
+    if args.output is not None:
+        with open(args.output, 'w') as fh:
+            fh.write(','.join(header)+'\n')
+            for row in rows:
+                fh.write(','.join(["%g" % v for v in row])+'\n')
+                
+    print("%8s %8s %8s  %10s %8s %7s %8s %7s %8s %7s" % ('dE', 'high', 'avg', 'detections', 'reports',
+                                                     'field', 'hours', 'ltng', 'hours', 'false'))
+    for row in rows:
+        print("%8.3f %8.2f %8.2f  %10i %8i %7i %8.2f %7i %8.2f %7i" % tuple(row))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='sweep the lightning detector settings over a collection of spinningCan.py recordings',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+            )
+    parser.add_argument('filename', type=str, nargs='+',
+                        help='recording to analyze or a directory of recordings to search')
+    parser.add_argument('-c', '--config-file', type=str, default='defaults.json',
+                        help='filename for the configuration file with the base settings')
+    parser.add_argument('-s', '--start', type=str,
+                        help='UTC start time, e.g. "2026-07-21 14:02:00"; required when searching a directory')
+    parser.add_argument('-e', '--stop', type=str,
+                        help='UTC stop time; required when searching a directory')
+    parser.add_argument('-m', '--min-efield-change', type=_values, default=[0.03, 0.04, 0.05, 0.06],
+                        help='comma separated list of minimum field changes in kV/m to try')
+    parser.add_argument('-f', '--high-field', type=_values, default=[4.0, 5.0, 6.0],
+                        help='comma separated list of high field values in kV/m to try')
+    parser.add_argument('-a', '--average-time', type=_values, default=[1.0,],
+                        help='comma separated list of averaging times in seconds to try')
+    parser.add_argument('-r', '--reference', type=str,
+                        help='file of reference strike times, one UTC time per line, for counting false alarms')
+    parser.add_argument('-t', '--tolerance', type=float, default=5.0,
+                        help='time in seconds a report can be from a reference strike')
+    parser.add_argument('-n', '--min-reports', type=int, default=2,
+                        help='lightning alerts with fewer reports are false alarms when there is no reference')
+    parser.add_argument('-p', '--processes', type=int, default=cpu_count(),
+                        help='number of worker processes to use')
+    parser.add_argument('-o', '--output', type=str,
+                        help='also write the results to this CSV file')
+    args = parser.parse_args()
+    if any(os.path.isdir(f) for f in args.filename) and (args.start is None or args.stop is None):
+        parser.error("a start and stop time are needed when searching a directory")
+        
+    # Parse the configuration file
+    with open(args.config_file, 'r') as ch:
+        args.config_file = json.loads(json_minify.json_minify(ch.read()))
+        
+    main(args)